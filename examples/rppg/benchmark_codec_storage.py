@@ -0,0 +1,101 @@
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+import torch
+
+from rppg.nets.POS import POS
+from rppg.utils.funcs import calculate_hr
+from rppg.utils.hdf5_storage import HDF5VideoWriter, open_video
+
+
+def encode_copy(file_name, path, codec, quality, compression, chunk_frames):
+    """
+    Rewrites the raw_video of a float32 CONT file with codec (None: float32 with compression), labels are copied.
+    """
+    with h5py.File(file_name, 'r') as file, HDF5VideoWriter(path, chunk_frames, compression, codec, quality) as writer:
+        raw_video = file['raw_video']
+        video = writer.create_video('raw_video', raw_video.shape[1:])
+        for start in range(0, len(raw_video), chunk_frames):
+            for frame in raw_video[start:start + chunk_frames]:
+                video.append(frame)
+        writer.commit(preprocessed_label=file['preprocessed_label'][:], hrv=file['hrv'][:])
+
+
+def read_clips(path, time_length):
+    """
+    :return: clips of time_length frames decoded on demand as the loaders do, frames per second
+    """
+    with h5py.File(path, 'r') as file:
+        video = open_video(file, 'raw_video')
+        start = time.time()
+        clips = [video[i:i + time_length] for i in range(0, len(video) - time_length + 1, time_length)]
+        return clips, sum(len(clip) for clip in clips) / (time.time() - start)
+
+
+def pos_hr(clips, fs=30.):
+    """
+    :return: POS pulse of every clip and its FFT heart rate
+    """
+    # POS squeezes the batch axis, the clips go through as one batch of at least two
+    batch = np.transpose(np.asarray(clips + clips[:1] if len(clips) == 1 else clips), (0, 4, 1, 2, 3))
+    with torch.no_grad():
+        pulses = POS()(torch.tensor(batch, dtype=torch.float32)).numpy()[:len(clips)]
+    return pulses, np.asarray([calculate_hr('FFT', pulse, fs=fs) for pulse in pulses])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="size, decode speed and rPPG drift of preprocess.common.storage.codec "
+                                                 "against float32 CONT files")
+    parser.add_argument("files", nargs="+", help="float32 CONT hdf5 files")
+    parser.add_argument("--codecs", nargs="+", default=["png", "jpeg"])
+    parser.add_argument("--jpeg_quality", type=int, nargs="+", default=[95, 85])
+    parser.add_argument("--compression", default="lzf", help="hdf5 filter of the float32 reference")
+    parser.add_argument("--time_length", type=int, default=180)
+    args = parser.parse_args()
+
+    variants = [('float32', None, 0)]
+    for codec in args.codecs:
+        qualities = args.jpeg_quality if codec == 'jpeg' else [0]
+        variants += [('%s-%d' % (codec, q) if codec == 'jpeg' else codec, codec, q) for q in qualities]
+
+    tmp_dir = tempfile.mkdtemp(prefix='codec_storage_')
+    report = {name: dict(size=0, fps=[], max_error=0., psnr=[], hr_error=[], pulse_corr=[]) for name, _, _ in variants}
+    for file_name in args.files:
+        reference = None
+        for name, codec, quality in variants:
+            path = os.path.join(tmp_dir, name + '.hdf5')
+            encode_copy(file_name, path, codec, quality, args.compression, args.time_length)
+            clips, fps = read_clips(path, args.time_length)
+            pulses, hrs = pos_hr(clips)
+            result = report[name]
+            result['size'] += os.path.getsize(path)
+            result['fps'].append(fps)
+            if reference is None:
+                reference = clips, pulses, hrs
+            else:
+                for clip, ref_clip in zip(clips, reference[0]):
+                    error = np.abs(clip - ref_clip)
+                    result['max_error'] = max(result['max_error'], float(error.max()))
+                    result['psnr'].append(10 * np.log10(1. / max(np.mean(error ** 2), 1e-12)))
+                result['hr_error'] += list(np.abs(hrs - reference[2]))
+                result['pulse_corr'] += [np.corrcoef(a, b)[0, 1] for a, b in zip(pulses, reference[1])]
+            os.remove(path)
+    os.rmdir(tmp_dir)
+
+    print("%d files, clips of %d frames" % (len(args.files), args.time_length))
+    print("storage     size(MB)  ratio  decode(fps)  max err(/255)  PSNR(dB)  POS HR MAE(bpm)  pulse r")
+    reference_size = report['float32']['size']
+    for name, _, _ in variants:
+        result = report[name]
+        if name == 'float32':
+            print("%-10s %9.1f %6.2f %12.0f %14s %9s %16s %8s" % (name, result['size'] / 2 ** 20, 1.,
+                                                                  np.mean(result['fps']), '-', '-', '-', '-'))
+            continue
+        print("%-10s %9.1f %6.2f %12.0f %14.2f %9.1f %16.3f %8.4f" % (
+            name, result['size'] / 2 ** 20, reference_size / result['size'], np.mean(result['fps']),
+            result['max_error'] * 255, np.mean(result['psnr']), np.mean(result['hr_error']),
+            np.mean(result['pulse_corr'])))
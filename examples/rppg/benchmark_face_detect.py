@@ -0,0 +1,43 @@
+import argparse
+
+import cv2
+
+from rppg.preprocessing.face_detectors import FACE_DETECTORS, benchmark_face_detectors
+
+
+def read_frames(video_path, max_frames):
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="face detector speed/accuracy for preprocess.common."
+                                                 "face_detect_algorithm and detect_scale")
+    parser.add_argument("video_path")
+    parser.add_argument("--detectors", nargs="+", default=sorted(FACE_DETECTORS), choices=sorted(FACE_DETECTORS))
+    parser.add_argument("--reference", default="hog", choices=sorted(FACE_DETECTORS),
+                        help="detector at full resolution whose boxes are the reference")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.5, 0.25])
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    frames = read_frames(args.video_path, args.frames)
+    print("%d frames of %dx%d, reference: %s at scale 1" % (len(frames), frames[0].shape[1], frames[0].shape[0],
+                                                            args.reference))
+
+    print("detector   scale    fps  detected  mean IoU  center err(px)")
+    for scale in args.scales:
+        report = benchmark_face_detectors(frames, args.detectors, args.reference, scale, reference_scale=1.)
+        for name in args.detectors:
+            if name not in report:
+                continue
+            result = report[name]
+            print("%-9s %6.2f %6.1f %8.1f%% %9.3f %14.1f" % (name, scale, result['fps'], result['detected'] * 100,
+                                                            result['iou'], result['center_error']))
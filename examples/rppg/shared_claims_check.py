@@ -0,0 +1,125 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import rppg.preprocessing.dataset_preprocess as dataset_preprocess
+from rppg.config import get_config
+from rppg.preprocessing.claims import CLAIM_DIR
+from rppg.preprocessing.face_detectors import FaceDetector, register_face_detector
+from rppg.preprocessing.manifest import MANIFEST_NAME
+
+
+@register_face_detector('center')
+class CenterFaceDetector(FaceDetector):
+    """
+        The middle half of the frame as the face, so the synthetic videos need no real face.
+    """
+
+    def _detect(self, frames):
+        return [((h // 4, w * 3 // 4, h * 3 // 4, w // 4), 1.) for h, w in (frame.shape[:2] for frame in frames)]
+
+
+preprocess_Dataset = dataset_preprocess.preprocess_Dataset
+
+
+def logged_preprocess_Dataset(preprocess_type, dataset_root_path, data_path, *args, **kwargs):
+    """
+    preprocess_Dataset of the pool workers, logs every file it writes and takes at least work_time seconds so the
+    claims have to be refreshed while it runs.
+    """
+    start = time.time()
+    preprocess_Dataset(preprocess_type, dataset_root_path, data_path, *args, **kwargs)
+    time.sleep(max(0., float(os.environ['CLAIMS_CHECK_WORK_TIME']) - (time.time() - start)))
+    with open(os.environ['CLAIMS_CHECK_LOG'], 'a') as f:
+        f.write('%s %s\n' % (os.environ['CLAIMS_CHECK_RUN'], data_path))
+
+
+# set at import so spawned workers use it too
+dataset_preprocess.preprocess_Dataset = logged_preprocess_Dataset
+
+
+def make_dataset(root, subjects, frames, size=96, fps=30.):
+    """
+    Writes a synthetic UBFC dataset (vid.avi, ground_truth.txt) of pulsing color frames.
+    """
+    rng = np.random.default_rng(0)
+    for subject in range(1, subjects + 1):
+        path = os.path.join(root, 'UBFC', 'subject%d' % subject)
+        os.makedirs(path)
+        t = np.arange(frames) / fps
+        pulse = np.sin(2 * np.pi * rng.uniform(1., 2.) * t)
+        writer = cv2.VideoWriter(os.path.join(path, 'vid.avi'), cv2.VideoWriter_fourcc(*'MJPG'), fps, (size, size))
+        for value in pulse:
+            writer.write(np.full((size, size, 3), 128 + 20 * value, np.uint8))
+        writer.release()
+        with open(os.path.join(path, 'ground_truth.txt'), 'w') as f:
+            for row in [pulse, np.full(frames, 80.), t]:
+                f.write(' '.join('%.6e' % v for v in row) + '\n')
+
+
+def run(name, data_root, dataset_path, workers, timeout):
+    os.environ['CLAIMS_CHECK_RUN'] = name
+    cfg = get_config(os.path.join(os.path.dirname(dataset_preprocess.__file__), '..', 'configs', 'base_config.yaml'))
+    cfg.data_root_path = data_root
+    cfg.dataset_path = dataset_path
+    common = cfg.preprocess.common
+    common.shared_claims = True
+    common.claim_timeout = timeout
+    common.process_num = workers
+    common.type = 'CONT'
+    common.image_size = 36
+    common.face_detect_algorithm = 'center'
+    cfg.preprocess.train_dataset.name = 'UBFC'
+    dataset_preprocess.preprocessing(cfg, cfg.preprocess.train_dataset)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="two preprocessing() runs sharing one dataset_path through claim "
+                                                 "files (preprocess.common.shared_claims)")
+    parser.add_argument("--subjects", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=90)
+    parser.add_argument("--workers", type=int, default=2, help="process_num of each run")
+    parser.add_argument("--timeout", type=float, default=2., help="claim_timeout in seconds")
+    parser.add_argument("--work_time", type=float, default=3.,
+                        help="seconds per file, above timeout so claims only survive by being refreshed")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='shared_claims_')
+    data_root, dataset_path = os.path.join(root, 'raw') + '/', os.path.join(root, 'preprocessed')
+    make_dataset(data_root, args.subjects, args.frames)
+    os.environ['CLAIMS_CHECK_LOG'] = os.path.join(root, 'written.txt')
+    os.environ['CLAIMS_CHECK_WORK_TIME'] = str(args.work_time)
+
+    runs = [multiprocessing.Process(target=run, args=(name, data_root, dataset_path, args.workers, args.timeout))
+            for name in ['run0', 'run1']]
+    start = time.time()
+    for process in runs:
+        process.start()
+    for process in runs:
+        process.join()
+
+    with open(os.environ['CLAIMS_CHECK_LOG']) as f:
+        written = [line.split() for line in f]
+    cont_path = os.path.join(dataset_path, 'UBFC', 'CONT')
+    with open(os.path.join(cont_path, MANIFEST_NAME)) as f:
+        entries = json.load(f)
+    data_list = ['/subject%d' % subject for subject in range(1, args.subjects + 1)]
+    print("2 runs x %d workers, %d files in %.1fs: %s" % (args.workers, args.subjects, time.time() - start, root))
+    print("files per run: %s" % {name: sum(1 for run_name, _ in written if run_name == name)
+                                 for name in ['run0', 'run1']})
+
+    assert all(process.exitcode == 0 for process in runs), "a run failed"
+    counts = {data_path: sum(1 for _, path in written if path == data_path) for data_path in data_list}
+    assert all(count == 1 for count in counts.values()), "files not written exactly once: %s" % counts
+    assert all(os.path.isfile(os.path.join(cont_path, data_path[1:] + '.hdf5')) for data_path in data_list)
+    assert sorted(entries) == data_list, "manifest entries: %s" % sorted(entries)
+    assert all(entry['status'] == 'done' for entry in entries.values()), \
+        "manifest status: %s" % {key: entry['status'] for key, entry in entries.items()}
+    assert not os.listdir(os.path.join(cont_path, CLAIM_DIR)), "left over claims"
+    print("every file was written exactly once and is 'done' in the shared manifest")
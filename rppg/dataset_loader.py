@@ -1,9 +1,13 @@
+import functools
+import multiprocessing
 import os
 import random
+from multiprocessing import resource_tracker, shared_memory
+
 import cv2
 import h5py
 import numpy as np
-from torch.utils.data import ConcatDataset
+from numpy.lib.stride_tricks import sliding_window_view
 from torch.utils.data import DataLoader
 from torch.utils.data import random_split
 from torch.utils.data.sampler import Sampler
@@ -16,7 +20,15 @@ from rppg.datasets.PhysFormerDataset import PhysFormerDataset
 from rppg.datasets.RhythmNetDataset import RhythmNetDataset
 from rppg.datasets.VitamonDataset import VitamonDataset
 from rppg.datasets.EfficientPhysDataset import EfficientPhysDataset
+from rppg.datasets.LazyClipDataset import LazyClipDataset, build_clip_index
+from rppg.datasets.MultiFileDataset import MultiFileDataset
+from rppg.datasets.DiffStreamDataset import DiffStreamDataset
+from rppg.log import log_warning
+from rppg.preprocessing.diff_normalize import diff_normalize_video, diff_normalize_label
 from rppg.utils.funcs import detrend
+from rppg.utils.resize_cache import ResizeCache, CACHE_DIR_NAME
+# hdf5plugin registers the Blosc filter
+from rppg.utils.hdf5_storage import find_video, open_video, hdf5plugin  # noqa: F401
 import torch
 
 
@@ -55,6 +67,17 @@ def data_loader(datasets, fit_cfg):
     time_length = fit_cfg.time_length
     shuffle = fit_cfg.train.shuffle
     meta = fit_cfg.train.meta.flag
+    device = torch.device(fit_cfg.device if torch.cuda.is_available() else 'cpu')
+    num_workers = fit_cfg.num_workers
+
+    loader_kwargs = dict(num_workers=num_workers, pin_memory=device.type == 'cuda',
+                         worker_init_fn=seed_worker, generator=g)
+    if num_workers > 0:
+        loader_kwargs.update(prefetch_factor=fit_cfg.prefetch_factor,
+                             persistent_workers=fit_cfg.persistent_workers)
+
+    def get_loader(dataset, batch_size, **kwargs):
+        return DeviceLoader(DataLoader(dataset, batch_size=batch_size, **kwargs, **loader_kwargs), device)
 
     if meta:
         data_loader = []
@@ -63,11 +86,17 @@ def data_loader(datasets, fit_cfg):
             support_len = int(np.floor(dataset_len * 0.8))
             query_len = dataset_len - support_len
             support_dataset, query_dataset = random_split(dataset, [support_len, query_len])
-            support_loader = DataLoader(support_dataset, batch_size=train_batch_size, shuffle=False)
-            query_loader = DataLoader(query_dataset, batch_size=train_batch_size, shuffle=False)
+            support_loader = get_loader(support_dataset, train_batch_size, shuffle=False)
+            query_loader = get_loader(query_dataset, train_batch_size, shuffle=False)
             data_loader.append([support_loader, query_loader])
         return data_loader
 
+    if isinstance(datasets[0], DiffStreamDataset):
+        # streamed DIFF datasets yield whole time_length aligned batches and shuffle blocks themselves
+        if datasets.__len__() > 1:  # training and validation
+            datasets[0].shuffle = datasets[1].shuffle = shuffle
+        return [get_loader(dataset, None) for dataset in datasets]
+
     test_loader = []
     if datasets.__len__() == 3 or datasets.__len__() == 2:
         if model_type == 'DIFF':
@@ -86,40 +115,82 @@ def data_loader(datasets, fit_cfg):
             sampler_train = ClipSampler(idx_train)
             sampler_validation = ClipSampler(idx_validation)
 
-            train_loader = DataLoader(datasets[0], batch_size=(train_batch_size * time_length),
-                                      sampler=sampler_train, shuffle=shuffle,
-                                      worker_init_fn=seed_worker, generator=g)
-            validation_loader = DataLoader(datasets[1], batch_size=(train_batch_size * time_length),
-                                           sampler=sampler_validation, shuffle=shuffle,
-                                           worker_init_fn=seed_worker, generator=g)
+            train_loader = get_loader(datasets[0], train_batch_size * time_length,
+                                      sampler=sampler_train, shuffle=shuffle)
+            validation_loader = get_loader(datasets[1], train_batch_size * time_length,
+                                           sampler=sampler_validation, shuffle=shuffle)
             if datasets.__len__() == 2:  # for training and validation
                 return [train_loader, validation_loader]
             elif datasets.__len__() == 3:  # for training, validation and test
-                test_loader = DataLoader(datasets[2], batch_size=(test_batch_size * time_length),
-                                         shuffle=shuffle, worker_init_fn=seed_worker, generator=g)
+                test_loader = get_loader(datasets[2], test_batch_size * time_length, shuffle=shuffle)
                 return [train_loader, validation_loader, test_loader]
         else:  # model_type == 'CONT'
-            train_loader = DataLoader(datasets[0], batch_size=train_batch_size, shuffle=shuffle,
-                                      worker_init_fn=seed_worker, generator=g)
-            validation_loader = DataLoader(datasets[1], batch_size=train_batch_size,
-                                           shuffle=shuffle, worker_init_fn=seed_worker, generator=g)
+            train_loader = get_loader(datasets[0], train_batch_size, shuffle=shuffle)
+            validation_loader = get_loader(datasets[1], train_batch_size, shuffle=shuffle)
             if datasets.__len__() == 2:  # for training and validation
                 return [train_loader, validation_loader]
             elif datasets.__len__() == 3:  # for training, validation and test
-                test_loader = DataLoader(datasets[2], batch_size=(test_batch_size * time_length),
-                                         shuffle=shuffle, worker_init_fn=seed_worker, generator=g)
+                test_loader = get_loader(datasets[2], test_batch_size * time_length, shuffle=shuffle)
                 return [train_loader, validation_loader, test_loader]
 
     elif datasets.__len__() == 1:
         if model_type == 'DIFF':
-            test_loader = DataLoader(datasets[0], batch_size=(test_batch_size * time_length), shuffle=False,
-                                     worker_init_fn=seed_worker, generator=g)
+            test_loader = get_loader(datasets[0], test_batch_size * time_length, shuffle=False)
         else:  # model_type == 'CONT'
-            test_loader = DataLoader(datasets[0], batch_size=test_batch_size, shuffle=False,
-                                     worker_init_fn=seed_worker, generator=g)
+            test_loader = get_loader(datasets[0], test_batch_size, shuffle=False)
         return [test_loader]
 
 
+def to_device(batch, device, non_blocking=False):
+    if isinstance(batch, (tuple, list)):
+        return type(batch)(to_device(b, device, non_blocking) for b in batch)
+    return batch.to(device, non_blocking=non_blocking)
+
+
+class DeviceLoader:
+    """
+        Moves whole batches of a DataLoader to the target device.
+        Datasets return CPU tensors; on CUDA the next (pinned) batch is copied on a side stream
+        while the current batch is being used.
+    """
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.device = device
+
+    def __iter__(self):
+        if self.device.type != 'cuda':
+            for batch in self.loader:
+                yield to_device(batch, self.device)
+            return
+
+        stream = torch.cuda.Stream(device=self.device)
+        current_stream = torch.cuda.current_stream(self.device)
+        prefetched = None
+        for batch in self.loader:
+            with torch.cuda.stream(stream):
+                batch = to_device(batch, self.device, non_blocking=True)
+            if prefetched is not None:
+                yield prefetched
+            current_stream.wait_stream(stream)
+            record_stream(batch, current_stream)
+            prefetched = batch
+        if prefetched is not None:
+            yield prefetched
+
+    def __len__(self):
+        return len(self.loader)
+
+
+def record_stream(batch, stream):
+    if isinstance(batch, (tuple, list)):
+        for b in batch:
+            record_stream(b, stream)
+    else:
+        batch.record_stream(stream)
+
+
 def dataset_loader(fit_cfg, dataset_path):
     model_name = fit_cfg.model
     dataset_name = [fit_cfg.train.dataset, fit_cfg.test.dataset]
@@ -130,6 +201,12 @@ def dataset_loader(fit_cfg, dataset_path):
     train_flag = fit_cfg.train_flag
     eval_flag = fit_cfg.eval_flag
     debug_flag = fit_cfg.debug_flag
+    lazy_load = fit_cfg.lazy_load
+    ingest_workers = fit_cfg.ingest_workers
+    compact_storage = fit_cfg.compact_storage
+    diff_from_cont = fit_cfg.diff_from_cont
+    shuffle_buffer = fit_cfg.shuffle_buffer
+    resize_cache = ResizeCache(fit_cfg.resize_cache.max_size_gb) if fit_cfg.resize_cache.flag else None
     # meta = fit_cfg.train.meta.flag
 
     save_root_path = dataset_path
@@ -141,8 +218,11 @@ def dataset_loader(fit_cfg, dataset_path):
     else:
         model_type = 'CONT'
 
+    # DIFF inputs can be derived from the CONT files instead of a separate DIFF preprocessing run
+    storage_type = 'CONT' if model_type == 'DIFF' and diff_from_cont else model_type.split('_')[0]
+
     if dataset_name[0] == dataset_name[1]:  # for counterpart goto 169 line
-        root_file_path = save_root_path + dataset_name[0] + "/" + model_type.split('_')[0]  # + "_" + preprocessed_img_size
+        root_file_path = save_root_path + dataset_name[0] + "/" + storage_type  # + "_" + preprocessed_img_size
 
         path = get_all_files_in_path(root_file_path)
         if debug_flag:
@@ -166,7 +246,7 @@ def dataset_loader(fit_cfg, dataset_path):
             val_path = path[train_len:]
 
     else:  # dataset_name[0] != dataset_name[1], for counterpart goto 145 line
-        root_file_path = save_root_path + dataset_name[0] + "/"  + model_type.split('_')[0]  # + "_" + preprocessed_img_size
+        root_file_path = save_root_path + dataset_name[0] + "/"  + storage_type  # + "_" + preprocessed_img_size
         if not os.path.exists(root_file_path):
             raise FileExistsError("There is no dataset in the path : ", root_file_path)
 
@@ -181,7 +261,7 @@ def dataset_loader(fit_cfg, dataset_path):
             val_path = path[train_len:]
 
         if eval_flag:
-            root_file_path = save_root_path + dataset_name[1] + "/"  + model_type.split('_')[0]  # + "_" + preprocessed_img_size
+            root_file_path = save_root_path + dataset_name[1] + "/"  + storage_type  # + "_" + preprocessed_img_size
             if not os.path.exists(root_file_path):
                 raise FileExistsError("There is no dataset in the path : ", root_file_path)
             path = get_all_files_in_path(root_file_path)[:]
@@ -265,12 +345,17 @@ def dataset_loader(fit_cfg, dataset_path):
     dataset = []
     if train_flag:
         train_dataset = get_dataset(train_path, model_type, model_name, time_length, batch_size,
-                                    overlap_interval, img_size, False)
+                                    overlap_interval, img_size, False, lazy_load, resize_cache, ingest_workers,
+                                    compact_storage, diff_from_cont, shuffle_buffer)
         dataset.append(train_dataset)
-        val_dataset = get_dataset(val_path, model_type, model_name, time_length, batch_size, 0, img_size, False)
+        val_dataset = get_dataset(val_path, model_type, model_name, time_length, batch_size, 0, img_size, False,
+                                  lazy_load, resize_cache, ingest_workers, compact_storage, diff_from_cont,
+                                  shuffle_buffer)
         dataset.append(val_dataset)
     if eval_flag:
-        eval_dataset = get_dataset(eval_path, model_type, model_name, time_length, batch_size, 0, img_size, True)
+        eval_dataset = get_dataset(eval_path, model_type, model_name, time_length, batch_size, 0, img_size, True,
+                                   lazy_load, resize_cache, ingest_workers, compact_storage, diff_from_cont,
+                                   shuffle_buffer)
         dataset.append(eval_dataset)
 
     return dataset
@@ -317,8 +402,10 @@ def get_all_files_in_path(path):
     """
     files = []
     for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = [dirname for dirname in dirnames if dirname != CACHE_DIR_NAME]
         for filename in filenames:
-            files.append(os.path.join(dirpath, filename))
+            if filename.endswith('.hdf5'):  # skips the preprocessing manifest
+                files.append(os.path.join(dirpath, filename))
     condition = []  # 조건 별로 사람 가지고 오고 싶으면 여기 추가
     '''
     condition 사용하고 싶으면 추가적으로 annotation 파일 만들어서 사용해야 할듯.
@@ -328,198 +415,350 @@ def get_all_files_in_path(path):
     return files
 
 
-def get_dataset(path, model_type, model_name, time_length, batch_size, overlap_interval, img_size, eval_flag):
-    idx = 0
-    round_flag = 0
-    rst_dataset = None
-    datasets = []
-
-    while True:
-        if round_flag == 0:
-            if model_type == 'DIFF':
-                appearance_data = []
-                motion_data = []
-                label_data = []
-            elif model_type.__contains__('CONT'):
-                video_data = []
-                label_data = []
-                hr_data = []
-                keypoint_data = []
-            round_flag = 1
-        elif round_flag == 1:
-            if idx == len(path):
-                break
-            file_name = path[idx]
-            print(file_name)
-            if not os.path.isfile(file_name):
-                print("Stopped at ", idx)
-                break
-
-            idx += 1
-            file = h5py.File(file_name)
-            # h5_tree(file)
-            if model_type == 'DIFF':
-                num_frame, w, h, c = file['raw_video'][:].shape
-                if model_name == "BigSmall":
-                    for i in range(num_frame):
-                        img = file['raw_video'][i]
-                        appearance_data.append(cv2.resize(img[:, :, 3:], (144, 144), interpolation=cv2.INTER_AREA))
-                        motion_data.append(cv2.resize(img[:, :, :3], (9, 9), interpolation=cv2.INTER_AREA))
-
-                elif w != img_size:
-                    new_shape = (num_frame, img_size, img_size, c)
-                    resized_img = np.zeros(new_shape)
-                    for i in range(num_frame):
-                        img = file['raw_video'][i]
-                        resized_img[i] = cv2.resize(img, (img_size, img_size))
-                    appearance_data.extend(resized_img[:, :, :, -3:])
-                    motion_data.extend(resized_img[:, :, :, :3])
-                else:
-                    appearance_data.extend(file['raw_video'][:, :, :, -3:])
-                    motion_data.extend(file['raw_video'][:, :, :, :3])
-
-                temp_label = file['preprocessed_label']
-                # resample label data
-                if len(temp_label) != num_frame:
-                    print('-----Resampling label data-----')
-                    temp_label = np.interp(
-                        np.linspace(
-                            1, len(temp_label), num_frame), np.linspace(
-                            1, len(temp_label), len(temp_label)), temp_label)
-                label_data.extend(temp_label)
-
-                num_frame = (num_frame // (time_length * batch_size)) * (time_length * batch_size)
-                appearance_data = appearance_data[:num_frame]
-                motion_data = motion_data[:num_frame]
-                label_data = label_data[:num_frame]
-
-            elif model_name in ["APNETv2"]:
-                start = 0
-                end = time_length
-                label = detrend(file['preprocessed_label'], 100)
-
-                while end <= len(file['raw_video']):
-                    video_chunk = file['raw_video'][start:end]
-                    video_data.append(video_chunk)
-                    keypoint_data.append(file['keypoint'][start:end])
-                    tmp_label = label[start:end]
-
-                    tmp_label = np.around(normalize(tmp_label, 0, 1), 2)
-                    label_data.append(tmp_label)
-                    # video_chunks.append(video_chunk)
-                    start += time_length - overlap_interval
-                    end += time_length - overlap_interval
-
-            elif model_name in ["EfficientPhys"]:
-                label = file['preprocessed_label']
-                diff_norm_label = np.diff(label, axis=0)
-                diff_norm_label /= np.std(diff_norm_label)
-                diff_norm_label = np.array(diff_norm_label)
-                diff_norm_label[np.isnan(diff_norm_label)] = 0
-
-                num_frame, w, h, c = file['raw_video'][:].shape
-                if w != img_size and h != img_size:
-                    new_shape = (num_frame, img_size, img_size, c)
-                    resized_img = np.zeros(new_shape, dtype=np.float32)
-                    for i in range(num_frame):
-                        img = file['raw_video'][i]  # / 255.
-                        resized_img[i] = cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_AREA)
-                    diff_video = np.diff(resized_img, axis=0)
-                else:
-                    diff_video = np.diff(file['raw_video'][:], axis=0)
-
-                num_frame = ((num_frame - 1) // time_length) * time_length
-                label_data.extend(diff_norm_label[:num_frame])
-                video_data.extend(diff_video[:num_frame])
+def resize_video(file_name, raw_video, img_size, interpolation, channels=slice(None), raw=False, resize_cache=None):
+    """
+    :param file_name: source hdf5 file path, used as the cache key
+    :param raw_video: 'raw_video' dataset of the opened hdf5 file
+    :param img_size: target image size
+    :param interpolation: cv2 interpolation flag
+    :param channels: channel slice of the source video to resize
+    :param raw: True for CONT_RAW models (uint8, BGR to RGB, center crop)
+    :param resize_cache: ResizeCache instance, None to always resize
+    :return: resized video of shape (num_frame, img_size, img_size, c)
+    """
 
-            else:
-                start = 0
-                end = time_length
-                # label = detrend(file['preprocessed_label'], 100)
-                label = file['preprocessed_label']
-                hr_label = file['hrv']
-                num_frame, w, h, c = file['raw_video'][:].shape
-
-                if len(label) != num_frame:
-                    label = np.interp(
-                        np.linspace(
-                            1, len(label), num_frame), np.linspace(
-                            1, len(label), len(label)), label)
-
-                if w != img_size and h != img_size:
-                    new_shape = (num_frame, img_size, img_size, c)
-                    if model_type.__contains__('RAW'):
-                        resized_img = np.zeros(new_shape, dtype=np.uint8)
-                        for i in range(num_frame):
-                            img = file['raw_video'][i] * 255
-                            w, h, c = img.shape
-                            w_m, h_m = w - round(w * 2/3), h - round(h * 2/3)
-                            img = cv2.cvtColor(img.astype(np.uint8),cv2.COLOR_BGR2RGB)
-                            resized_img[i] = cv2.resize(img[w_m//2:-w_m//2,h_m//2:-h_m//2], (img_size, img_size), interpolation=cv2.INTER_AREA)
-                    else:
-                        resized_img = np.zeros(new_shape, dtype=np.float32)
-                        for i in range(num_frame):
-                            img = file['raw_video'][i]
-                            resized_img[i] = cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_AREA)
-
-                while end <= len(file['raw_video']):
-                    if w != img_size:
-                        video_chunk = resized_img[start:end]
-                    else:
-                        video_chunk = file['raw_video'][start:end]
-                    if not model_type.__contains__('RAW'):
-                        video_chunk = (video_chunk - np.mean(video_chunk)) / np.std(video_chunk)
-                    # video_chunk = int(video_chunk*)
-                    video_data.append(video_chunk)
-                    tmp_label = label[start:end]
-
-                    # tmp_label = np.around(normalize(tmp_label, 0, 1), 2)
-                    label_data.append(tmp_label)
-                    hr_data.append(hr_label[start:end].mean())
-                    # video_chunks.append(video_chunk)
-                    start += time_length - overlap_interval
-                    end += time_length - overlap_interval
-
-            file.close()
-            round_flag = 2
-        elif round_flag == 2:
-            if model_type == 'DIFF':
-                dataset = DeepPhysDataset(appearance_data=np.asarray(appearance_data),
-                                          motion_data=np.asarray(motion_data),
-                                          target=np.asarray(label_data))
-            elif model_name in ["APNETv2"]:
-                dataset = APNETv2Dataset(video_data=np.asarray(video_data),
-                                         keypoint_data=np.asarray(keypoint_data),
-                                         label_data=np.asarray(label_data),
-                                         target_length=time_length,
-                                         img_size=img_size)
-            elif model_name in ["EfficientPhys"]:
-                dataset = EfficientPhysDataset(video_data=np.asarray(video_data),
-                                               label_data=np.asarray(label_data))
-            elif model_name in ["PhysFormer"]:
-                dataset = PhysFormerDataset(video_data=np.asarray(video_data),
-                                            label_data=np.asarray(label_data),
-                                            average_hr=np.asarray(hr_data),
-                                            target_length=time_length)
-            elif model_type.__contains__('CONT'):
-                dataset = PhysNetDataset(video_data=np.asarray(video_data),
-                                         label_data=np.asarray(label_data),
-                                         target_length=time_length)
-            # elif model_name in ["RhythmNet"]:
-            #     dataset = RhythmNetDataset(st_map_data=np.asarray(st_map_data),
-            #                                target_data=np.asarray(target_data))
-            elif model_name in ["ETArPPGNet"]:
-                dataset = ETArPPGNetDataset(video_data=np.asarray(video_data),
-                                            label_data=np.asarray(label_data))
-
-            elif model_name in ["Vitamon", "Vitamon_phase2"]:
-                dataset = VitamonDataset(video_data=np.asarray(video_data),
-                                         label_data=np.asarray(label_data))
-            datasets = [rst_dataset, dataset]
-            rst_dataset = ConcatDataset([dataset for dataset in datasets if dataset is not None])
-            round_flag = 0
-
-    return rst_dataset
+    def resize_fn():
+        num_frame, w, h, c = raw_video.shape
+        c = len(range(c)[channels])
+        new_shape = (num_frame, img_size, img_size, c)
+        if raw:
+            resized_img = np.zeros(new_shape, dtype=np.uint8)
+            w_m, h_m = w - round(w * 2 / 3), h - round(h * 2 / 3)
+            for i in range(num_frame):
+                img = raw_video[i][:, :, channels] * 255
+                img = cv2.cvtColor(img.astype(np.uint8), cv2.COLOR_BGR2RGB)
+                resized_img[i] = cv2.resize(img[w_m // 2:-w_m // 2, h_m // 2:-h_m // 2], (img_size, img_size),
+                                            interpolation=interpolation)
+        else:
+            resized_img = np.zeros(new_shape, dtype=np.float32)
+            for i in range(num_frame):
+                resized_img[i] = np.reshape(cv2.resize(raw_video[i][:, :, channels], (img_size, img_size),
+                                                       interpolation=interpolation), new_shape[1:])
+        return resized_img
+
+    if resize_cache is None:
+        return resize_fn()
+    return resize_cache.load(file_name, img_size, interpolation, channels, resize_fn, mode='raw' if raw else '')
+
+
+def clip_windows(data, time_length, step):
+    """
+    :param data: array with frames on the first axis
+    :param time_length: number of frames per clip
+    :param step: number of frames between the starts of two consecutive clips
+    :return: read-only strided view of shape (num_clips, time_length, ...), overlapping clips share memory
+    """
+    if len(data) < time_length:
+        return np.empty((0, time_length) + data.shape[1:], dtype=data.dtype)
+    windows = sliding_window_view(data, time_length, axis=0)[::step]
+    return np.moveaxis(windows, -1, 1)
+
+
+def get_dataset(path, model_type, model_name, time_length, batch_size, overlap_interval, img_size, eval_flag,
+                lazy_load=False, resize_cache=None, ingest_workers=0, compact_storage=False, diff_from_cont=False,
+                shuffle_buffer=16):
+    if lazy_load:
+        if model_type == 'DIFF':
+            path = [file_name for file_name in path if os.path.isfile(file_name)]
+            return DiffStreamDataset(file_list=path,
+                                     time_length=time_length,
+                                     batch_size=batch_size,
+                                     img_size=img_size,
+                                     model_name=model_name,
+                                     shuffle_buffer=shuffle_buffer,
+                                     diff_from_cont=diff_from_cont)
+        elif model_name in ["APNETv2", "EfficientPhys"]:
+            log_warning("lazy_load is only supported for CONT clip and DIFF models, loading %s in memory" % model_name)
+        else:
+            path = [file_name for file_name in path if os.path.isfile(file_name)]
+            return LazyClipDataset(file_list=path,
+                                   clip_index=build_clip_index(path, time_length, overlap_interval),
+                                   img_size=img_size,
+                                   raw=model_type.__contains__('RAW'),
+                                   average_hr=model_name in ["PhysFormer"])
+
+    existing_path = []
+    for idx, file_name in enumerate(path):
+        if not os.path.isfile(file_name):
+            print("Stopped at ", idx)
+            break
+        existing_path.append(file_name)
+
+    load_kwargs = dict(model_type=model_type, model_name=model_name, time_length=time_length, batch_size=batch_size,
+                       overlap_interval=overlap_interval, img_size=img_size, resize_cache=resize_cache,
+                       compact_storage=compact_storage, diff_from_cont=diff_from_cont)
+    if ingest_workers > 0 and len(existing_path) > 1:
+        # files are handed to a worker pool, arrays come back through shared memory and
+        # imap keeps the merge order identical to the file order
+        resource_tracker.ensure_running()  # one tracker shared with the workers, so the parent can unlink blocks
+        if resize_cache is not None:
+            # every worker would only see its own copy of the cache, the size cap is enforced here afterwards
+            load_kwargs['resize_cache'] = resize_cache.deferred()
+        with multiprocessing.Pool(min(ingest_workers, len(existing_path))) as pool:
+            file_data = pool.imap(functools.partial(load_file_to_shared_memory, **load_kwargs), existing_path)
+            datasets = [build_file_dataset(from_shared_memory(data), model_type, model_name, time_length,
+                                           overlap_interval, img_size) for data in file_data]
+        if resize_cache is not None:
+            resize_cache.evict_files(existing_path)
+    else:
+        datasets = [build_file_dataset(load_file(file_name, **load_kwargs), model_type, model_name, time_length,
+                                       overlap_interval, img_size) for file_name in existing_path]
+
+    return MultiFileDataset(datasets)
+
+
+def load_file(file_name, model_type, model_name, time_length, batch_size, overlap_interval, img_size,
+              resize_cache=None, compact_storage=False, diff_from_cont=False):
+    """
+    :param file_name: preprocessed hdf5 file path
+    :param compact_storage: keep CONT frames as uint8 with per-frame scale/offset and DIFF frames as float16
+    :param diff_from_cont: file_name is a CONT file, DIFF inputs and labels are derived from it
+    :return: dict of numpy arrays read from the file, turned into a dataset by build_file_dataset
+    """
+    print(file_name)
+    file = h5py.File(file_name)
+    # h5_tree(file)
+    # frames preprocessed at the size the model reads if the file has them, otherwise resized below;
+    # RAW models center-crop the stored frames, they always read raw_video
+    video_name = 'raw_video' if model_type.__contains__('RAW') else find_video(
+        file, 144 if model_name == "BigSmall" else img_size)
+    if model_type == 'DIFF':
+        raw_video = open_video(file, video_name)
+        label_data = file['preprocessed_label'][:]
+        if diff_from_cont:
+            raw_video = diff_normalize_video(raw_video)
+            label_data = diff_normalize_label(label_data)
+            # the resize cache is keyed by the source file, derived DIFF frames are resized in memory
+            resize_cache = None
+
+        num_frame, w, h, c = raw_video.shape
+        if model_name == "BigSmall":
+            appearance_data = resize_video(file_name, raw_video, 144, cv2.INTER_AREA,
+                                           channels=slice(3, None), resize_cache=resize_cache)
+            motion_data = resize_video(file_name, raw_video, 9, cv2.INTER_AREA,
+                                       channels=slice(None, 3), resize_cache=resize_cache)
+
+        elif w != img_size:
+            resized_img = resize_video(file_name, raw_video, img_size, cv2.INTER_LINEAR,
+                                       resize_cache=resize_cache)
+            appearance_data = resized_img[:, :, :, -3:]
+            motion_data = resized_img[:, :, :, :3]
+        else:
+            appearance_data = raw_video[:, :, :, -3:]
+            motion_data = raw_video[:, :, :, :3]
+
+        # resample label data
+        if len(label_data) != num_frame:
+            print('-----Resampling label data-----')
+            label_data = np.interp(
+                np.linspace(
+                    1, len(label_data), num_frame), np.linspace(
+                    1, len(label_data), len(label_data)), label_data)
+
+        num_frame = (num_frame // (time_length * batch_size)) * (time_length * batch_size)
+        data = dict(appearance_data=appearance_data[:num_frame],
+                    motion_data=motion_data[:num_frame],
+                    label_data=label_data[:num_frame])
+        if compact_storage:
+            data['appearance_data'] = data['appearance_data'].astype(np.float16)
+            data['motion_data'] = data['motion_data'].astype(np.float16)
+
+    elif model_name in ["APNETv2"]:
+        video_data = []
+        keypoint_data = []
+        label_data = []
+        start = 0
+        end = time_length
+        label = detrend(file['preprocessed_label'], 100)
+
+        while end <= len(file['raw_video']):
+            video_chunk = file['raw_video'][start:end]
+            video_data.append(video_chunk)
+            keypoint_data.append(file['keypoint'][start:end])
+            tmp_label = label[start:end]
+
+            tmp_label = np.around(normalize(tmp_label, 0, 1), 2)
+            label_data.append(tmp_label)
+            # video_chunks.append(video_chunk)
+            start += time_length - overlap_interval
+            end += time_length - overlap_interval
+        data = dict(video_data=np.asarray(video_data),
+                    keypoint_data=np.asarray(keypoint_data),
+                    label_data=np.asarray(label_data))
+
+    elif model_name in ["EfficientPhys"]:
+        label = file['preprocessed_label']
+        diff_norm_label = np.diff(label, axis=0)
+        diff_norm_label /= np.std(diff_norm_label)
+        diff_norm_label = np.array(diff_norm_label)
+        diff_norm_label[np.isnan(diff_norm_label)] = 0
+
+        raw_video = open_video(file, video_name)
+        num_frame, w, h, c = raw_video.shape
+        if w != img_size and h != img_size:
+            resized_img = resize_video(file_name, raw_video, img_size, cv2.INTER_AREA,
+                                       resize_cache=resize_cache)
+            diff_video = np.diff(resized_img, axis=0)
+        else:
+            diff_video = np.diff(raw_video[:], axis=0)
+
+        num_frame = ((num_frame - 1) // time_length) * time_length
+        data = dict(video_data=diff_video[:num_frame],
+                    label_data=diff_norm_label[:num_frame])
+        if compact_storage:
+            data['video_data'] = data['video_data'].astype(np.float16)
+
+    else:
+        # label = detrend(file['preprocessed_label'], 100)
+        label = file['preprocessed_label'][:]
+        hr_label = file['hrv'][:]
+        raw_video = open_video(file, video_name)
+        num_frame, w, h, c = raw_video.shape
+
+        if len(label) != num_frame:
+            label = np.interp(
+                np.linspace(
+                    1, len(label), num_frame), np.linspace(
+                    1, len(label), len(label)), label)
+
+        if w != img_size and h != img_size:
+            resized_img = resize_video(file_name, raw_video, img_size, cv2.INTER_AREA,
+                                       raw=model_type.__contains__('RAW'), resize_cache=resize_cache)
+
+        if w != img_size:
+            video = resized_img
+        else:
+            video = raw_video[:]
+        data = dict(video=video, label=label, hr_label=hr_label)
+        if compact_storage and video.dtype != np.uint8:
+            data['video'], data['video_scale'], data['video_offset'] = quantize_frames(video)
+
+    file.close()
+    return data
+
+
+def build_file_dataset(data, model_type, model_name, time_length, overlap_interval, img_size):
+    """
+    :param data: dict of numpy arrays returned by load_file
+    :return: dataset of a single preprocessed file
+    """
+    if model_type == 'DIFF':
+        dataset = DeepPhysDataset(appearance_data=np.asarray(data['appearance_data']),
+                                  motion_data=np.asarray(data['motion_data']),
+                                  target=np.asarray(data['label_data']))
+    elif model_name in ["APNETv2"]:
+        dataset = APNETv2Dataset(video_data=data['video_data'],
+                                 keypoint_data=data['keypoint_data'],
+                                 label_data=data['label_data'],
+                                 target_length=time_length,
+                                 img_size=img_size)
+    elif model_name in ["EfficientPhys"]:
+        dataset = EfficientPhysDataset(video_data=np.asarray(data['video_data']),
+                                       label_data=np.asarray(data['label_data']))
+    else:
+        # overlapping clips share the frames of one video array, the per-clip
+        # standardization is applied in the dataset's __getitem__
+        step = time_length - overlap_interval
+        video_data = clip_windows(data['video'], time_length, step)
+        label_data = clip_windows(data['label'], time_length, step)
+        hr_data = np.asarray([data['hr_label'][start:start + time_length].mean()
+                              for start in range(0, len(video_data) * step, step)])
+        video_scale, video_offset = None, None
+        if 'video_scale' in data:
+            video_scale = clip_windows(data['video_scale'], time_length, step)
+            video_offset = clip_windows(data['video_offset'], time_length, step)
+
+        if model_name in ["PhysFormer"]:
+            dataset = PhysFormerDataset(video_data=video_data,
+                                        label_data=label_data,
+                                        average_hr=hr_data,
+                                        target_length=time_length,
+                                        normalize_clip=not model_type.__contains__('RAW'),
+                                        video_scale=video_scale,
+                                        video_offset=video_offset)
+        elif model_type.__contains__('CONT'):
+            dataset = PhysNetDataset(video_data=video_data,
+                                     label_data=label_data,
+                                     target_length=time_length,
+                                     normalize_clip=not model_type.__contains__('RAW'),
+                                     video_scale=video_scale,
+                                     video_offset=video_offset)
+        # elif model_name in ["RhythmNet"]:
+        #     dataset = RhythmNetDataset(st_map_data=np.asarray(st_map_data),
+        #                                target_data=np.asarray(target_data))
+        elif model_name in ["ETArPPGNet"]:
+            dataset = ETArPPGNetDataset(video_data=video_data,
+                                        label_data=label_data)
+
+        elif model_name in ["Vitamon", "Vitamon_phase2"]:
+            dataset = VitamonDataset(video_data=video_data,
+                                     label_data=label_data)
+    return dataset
+
+
+def quantize_frames(video, block_size=256):
+    """
+    :param video: float video of shape (num_frame, h, w, c)
+    :param block_size: number of frames converted at once, bounds the float temporaries
+    :return: uint8 video, per-frame scale and offset (float32), video ~= q * scale + offset
+    """
+    num_frame = len(video)
+    offset = np.empty(num_frame, dtype=np.float32)
+    scale = np.empty(num_frame, dtype=np.float32)
+    quantized = np.empty(video.shape, dtype=np.uint8)
+    for start in range(0, num_frame, block_size):
+        block = np.asarray(video[start:start + block_size], dtype=np.float32)
+        block_min = block.min(axis=(1, 2, 3))
+        block_scale = (block.max(axis=(1, 2, 3)) - block_min) / 255.
+        block_scale[block_scale == 0] = 1.
+        offset[start:start + block_size] = block_min
+        scale[start:start + block_size] = block_scale
+        quantized[start:start + block_size] = np.rint(
+            (block - block_min[:, None, None, None]) / block_scale[:, None, None, None])
+    return quantized, scale, offset
+
+
+def load_file_to_shared_memory(file_name, **kwargs):
+    """
+    Worker side of the parallel ingestion: runs load_file and copies every array into a shared memory block,
+    so only (name, shape, dtype) tuples are pickled back to the parent process.
+    """
+    data = load_file(file_name, **kwargs)
+    shared_data = {}
+    for key, value in data.items():
+        value = np.asarray(value)
+        if value.nbytes == 0:
+            shared_data[key] = value
+            continue
+        shm = shared_memory.SharedMemory(create=True, size=value.nbytes)
+        np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)[...] = value
+        shared_data[key] = (shm.name, value.shape, value.dtype.str)
+        shm.close()
+    return shared_data
+
+
+def from_shared_memory(shared_data):
+    data = {}
+    for key, value in shared_data.items():
+        if isinstance(value, np.ndarray):
+            data[key] = value
+            continue
+        name, shape, dtype = value
+        shm = shared_memory.SharedMemory(name=name)
+        data[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+        shm.close()
+        shm.unlink()
+    return data
 
 
 class ClipSampler(Sampler):
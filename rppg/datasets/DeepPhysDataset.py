@@ -21,12 +21,6 @@ class DeepPhysDataset(Dataset):
 
         # inputs = torch.stack([appearance_data,motion_data],dim=0)
 
-        if torch.cuda.is_available():
-            # inputs = inputs.to('cuda')
-            appearance_data = appearance_data.to('cuda')
-            motion_data = motion_data.to('cuda')
-            target = target.to('cuda')
-
         return (appearance_data,motion_data), target
 
     def __len__(self):
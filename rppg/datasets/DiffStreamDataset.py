@@ -0,0 +1,137 @@
+import cv2
+import h5py
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from rppg.preprocessing.diff_normalize import diff_statistics, diff_normalize_frames, diff_normalize_label
+# hdf5plugin registers the Blosc filter
+from rppg.utils.hdf5_storage import find_video, open_video, hdf5plugin  # noqa: F401
+
+
+class DiffStreamDataset(IterableDataset):
+    """
+        Streaming dataset for DIFF models (DeepPhys, TSCAN, BigSmall).
+        Every item is a whole batch of batch_size * time_length contiguous frames read straight from one
+        preprocessed hdf5 file, so batches stay aligned to time_length without materializing frame lists.
+        Blocks are shuffled through a bounded buffer, memory stays constant regardless of the dataset size.
+        Use it with DataLoader(batch_size=None).
+    """
+
+    def __init__(self, file_list, time_length, batch_size, img_size, model_name, shuffle=False, shuffle_buffer=16,
+                 diff_from_cont=False):
+        """
+        :param file_list: preprocessed hdf5 file paths
+        :param time_length: number of frames per clip
+        :param batch_size: number of clips per block
+        :param img_size: model input image size
+        :param model_name: BigSmall reads 144px appearance and 9px motion frames
+        :param shuffle: shuffle the file order and the blocks
+        :param shuffle_buffer: number of blocks held to shuffle from
+        :param diff_from_cont: file_list holds CONT files, DIFF frames and labels are derived from them
+        """
+        self.file_list = list(file_list)
+        self.time_length = time_length
+        self.batch_size = batch_size
+        self.block_length = time_length * batch_size
+        self.img_size = img_size
+        self.model_name = model_name
+        self.shuffle = shuffle
+        self.shuffle_buffer = max(1, shuffle_buffer)
+        self.diff_from_cont = diff_from_cont
+
+        # number of whole blocks per file, the tail of each file is dropped as in load_file
+        self.num_blocks = []
+        for file_name in self.file_list:
+            with h5py.File(file_name, 'r') as file:
+                self.num_blocks.append(file['raw_video'].shape[0] // self.block_length)
+
+    def __len__(self):
+        return sum(self.num_blocks)
+
+    def _worker_files(self):
+        file_order = np.arange(len(self.file_list))
+        worker_info = get_worker_info()
+        if worker_info is None:
+            return np.random.permutation(file_order) if self.shuffle else file_order
+        if self.shuffle:
+            # every worker draws the same file permutation of this epoch and takes its own share of it
+            base_seed = (worker_info.seed - worker_info.id) % 2 ** 32
+            file_order = np.random.RandomState(base_seed).permutation(file_order)
+        return file_order[worker_info.id::worker_info.num_workers]
+
+    def _video(self, file):
+        # frames preprocessed at the size the model reads if the file has them, otherwise resized in _read_block
+        return open_video(file, find_video(file, 144 if self.model_name == "BigSmall" else self.img_size))
+
+    def _read_label(self, file, num_frame):
+        label = file['preprocessed_label'][:]
+        if self.diff_from_cont:
+            label = diff_normalize_label(label)
+        if len(label) != num_frame:
+            label = np.interp(
+                np.linspace(
+                    1, len(label), num_frame), np.linspace(
+                    1, len(label), len(label)), label)
+        return label
+
+    def _resize(self, frames, img_size, interpolation):
+        num_frame, w, h, c = frames.shape
+        if w == img_size and h == img_size:
+            return frames
+        resized_img = np.zeros((num_frame, img_size, img_size, c), dtype=np.float32)
+        for i in range(num_frame):
+            resized_img[i] = np.reshape(cv2.resize(frames[i], (img_size, img_size), interpolation=interpolation),
+                                        resized_img.shape[1:])
+        return resized_img
+
+    def _read_block(self, file, start, label, statistics):
+        end = start + self.block_length
+        if self.diff_from_cont:
+            frames = diff_normalize_frames(self._video(file), start, end, *statistics)
+        else:
+            frames = self._video(file)[start:end]
+
+        if self.model_name == "BigSmall":
+            appearance_data = self._resize(frames[:, :, :, 3:], 144, cv2.INTER_AREA)
+            motion_data = self._resize(frames[:, :, :, :3], 9, cv2.INTER_AREA)
+        else:
+            frames = self._resize(frames, self.img_size, cv2.INTER_LINEAR)
+            appearance_data = frames[:, :, :, -3:]
+            motion_data = frames[:, :, :, :3]
+
+        appearance_data = torch.tensor(np.transpose(appearance_data, (0, 3, 1, 2)), dtype=torch.float32)
+        motion_data = torch.tensor(np.transpose(motion_data, (0, 3, 1, 2)), dtype=torch.float32)
+        target = torch.tensor(label[start:end].reshape(-1, 1), dtype=torch.float32)
+        return (appearance_data, motion_data), target
+
+    def _iter_blocks(self):
+        for file_idx in self._worker_files():
+            if self.num_blocks[file_idx] == 0:
+                continue
+            with h5py.File(self.file_list[file_idx], 'r') as file:
+                num_frame = file['raw_video'].shape[0]
+                label = self._read_label(file, num_frame)
+                # motion std and appearance mean, the appearance is not standardized in DIFF files
+                statistics = diff_statistics(self._video(file))[:2] if self.diff_from_cont else None
+                starts = np.arange(self.num_blocks[file_idx]) * self.block_length
+                if self.shuffle:
+                    starts = np.random.permutation(starts)
+                for start in starts:
+                    yield self._read_block(file, start, label, statistics)
+
+    def __iter__(self):
+        if not self.shuffle:
+            yield from self._iter_blocks()
+            return
+
+        buffer = []
+        for block in self._iter_blocks():
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(block)
+                continue
+            idx = np.random.randint(len(buffer))
+            yield buffer[idx]
+            buffer[idx] = block
+        np.random.shuffle(buffer)
+        yield from buffer
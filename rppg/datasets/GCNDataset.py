@@ -25,11 +25,6 @@ class GCNDataset(Dataset):
         # bpm_data = torch.tensor(self.bpm[index],dtype=torch.float32)
 
 
-        if torch.cuda.is_available():
-            video_data = video_data.to('cuda')
-            label_data = label_data.to('cuda')
-            # bpm_data = bpm_data.to('cuda')
-
         return video_data, label_data  # , bpm_data
 
     def __len__(self):
@@ -0,0 +1,128 @@
+import os
+
+import cv2
+import h5py
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+# hdf5plugin registers the Blosc filter
+from rppg.utils.hdf5_storage import find_video, open_video, hdf5plugin  # noqa: F401
+
+
+class LazyClipDataset(Dataset):
+    """
+        Dataset class for CONT models which reads every clip from the preprocessed hdf5 file on demand.
+        Only a (file, start, end) index is kept in memory, so peak memory depends on the batch size
+        instead of the dataset size.
+    """
+
+    def __init__(self, file_list, clip_index, img_size, raw=False, average_hr=False):
+        """
+        :param file_list: preprocessed hdf5 file paths
+        :param clip_index: int64 array of shape (N, 3), each row is (file index, start frame, end frame)
+        :param img_size: model input image size
+        :param raw: True for CONT_RAW models (uint8, center crop, no standardization)
+        :param average_hr: True to also return the clip's average HR (PhysFormer)
+        """
+        self.file_list = list(file_list)
+        self.clip_index = np.asarray(clip_index, dtype=np.int64)
+        self.img_size = img_size
+        self.raw = raw
+        self.average_hr = average_hr
+
+        # h5py handles can't be shared across processes, so they are opened per worker
+        self._files = {}
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_files'] = {}
+        state['_pid'] = None
+        return state
+
+    def _get_file(self, file_idx):
+        if self._pid != os.getpid():
+            self._files = {}
+            self._pid = os.getpid()
+        file = self._files.get(file_idx)
+        if file is None:
+            file = h5py.File(self.file_list[file_idx], 'r')
+            self._files[file_idx] = file
+        return file
+
+    def _read_label(self, file, start, end):
+        label = file['preprocessed_label']
+        num_frame = file['raw_video'].shape[0]
+        if len(label) != num_frame:
+            label = np.interp(
+                np.linspace(
+                    1, len(label), num_frame), np.linspace(
+                    1, len(label), len(label)), label[:])
+        return np.asarray(label[start:end])
+
+    def _read_video(self, file, start, end):
+        # frames preprocessed at img_size if the file has them, otherwise resized below (RAW center-crops raw_video)
+        video_chunk = open_video(file, 'raw_video' if self.raw else find_video(file, self.img_size))[start:end]
+        num_frame, w, h, c = video_chunk.shape
+
+        if w != self.img_size and h != self.img_size:
+            new_shape = (num_frame, self.img_size, self.img_size, c)
+            if self.raw:
+                resized_img = np.zeros(new_shape, dtype=np.uint8)
+                for i in range(num_frame):
+                    img = video_chunk[i] * 255
+                    w_m, h_m = w - round(w * 2 / 3), h - round(h * 2 / 3)
+                    img = cv2.cvtColor(img.astype(np.uint8), cv2.COLOR_BGR2RGB)
+                    resized_img[i] = cv2.resize(img[w_m // 2:-w_m // 2, h_m // 2:-h_m // 2],
+                                                (self.img_size, self.img_size), interpolation=cv2.INTER_AREA)
+            else:
+                resized_img = np.zeros(new_shape, dtype=np.float32)
+                for i in range(num_frame):
+                    resized_img[i] = cv2.resize(video_chunk[i], (self.img_size, self.img_size),
+                                                interpolation=cv2.INTER_AREA)
+            video_chunk = resized_img
+
+        if not self.raw:
+            video_chunk = (video_chunk - np.mean(video_chunk)) / np.std(video_chunk)
+        return (video_chunk - 0.5) * 2
+
+    def __getitem__(self, index):
+        if torch.is_tensor(index):
+            index = index.tolist()
+
+        file_idx, start, end = self.clip_index[index]
+        file = self._get_file(file_idx)
+
+        video_data = torch.tensor(np.transpose(self._read_video(file, start, end), (3, 0, 1, 2)),
+                                  dtype=torch.float32)
+        label_data = torch.tensor(self._read_label(file, start, end), dtype=torch.float32)
+
+        if self.average_hr:
+            average_hr = np.clip(np.mean(file['hrv'][start:end]), 40., 180.) - 40.
+            average_hr = torch.tensor(average_hr, dtype=torch.float32)
+            return video_data, label_data, average_hr
+
+        return video_data, label_data
+
+    def __len__(self):
+        return len(self.clip_index)
+
+
+def build_clip_index(file_list, time_length, overlap_interval):
+    """
+    :param file_list: preprocessed hdf5 file paths
+    :param time_length: number of frames per clip
+    :param overlap_interval: number of frames shared by two consecutive clips
+    :return: int64 array of shape (N, 3), each row is (file index, start frame, end frame)
+    """
+    step = time_length - overlap_interval
+    clip_index = []
+    for file_idx, file_name in enumerate(file_list):
+        with h5py.File(file_name, 'r') as file:
+            num_frame = file['raw_video'].shape[0]
+        start = np.arange(0, num_frame - time_length + 1, step, dtype=np.int64)
+        clip_index.append(np.stack([np.full_like(start, file_idx), start, start + time_length], axis=1))
+    if len(clip_index) == 0:
+        return np.empty((0, 3), dtype=np.int64)
+    return np.concatenate(clip_index, axis=0)
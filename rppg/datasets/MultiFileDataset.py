@@ -0,0 +1,40 @@
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+
+class MultiFileDataset(Dataset):
+    """
+        Flat concatenation of per-file datasets.
+        Cumulative clip offsets are kept in a numpy array, so a global index is mapped to
+        (file, local index) with a single binary search regardless of the number of files.
+    """
+
+    def __init__(self, datasets):
+        self.datasets = [dataset for dataset in datasets if dataset is not None and len(dataset) > 0]
+        self.cumulative_sizes = np.cumsum([len(dataset) for dataset in self.datasets], dtype=np.int64)
+
+    def locate(self, index):
+        """
+        :param index: global clip index
+        :return: (file index, local clip index)
+        """
+        if index < 0:
+            if -index > len(self):
+                raise IndexError("index out of range")
+            index += len(self)
+        file_idx = int(np.searchsorted(self.cumulative_sizes, index, side='right'))
+        if file_idx == len(self.datasets):
+            raise IndexError("index out of range")
+        local_idx = index if file_idx == 0 else index - int(self.cumulative_sizes[file_idx - 1])
+        return file_idx, local_idx
+
+    def __getitem__(self, index):
+        if torch.is_tensor(index):
+            index = index.tolist()
+
+        file_idx, local_idx = self.locate(index)
+        return self.datasets[file_idx][local_idx]
+
+    def __len__(self):
+        return int(self.cumulative_sizes[-1]) if len(self.cumulative_sizes) else 0
@@ -24,10 +24,6 @@ class PPNetDataset(Dataset):
         inputs = ppg.reshape(1,-1)
         targets = torch.stack([sbp,dbp,hr],dim=0)
 
-        if torch.cuda.is_available():
-            inputs = inputs.to('cuda')
-            targets = targets.to('cuda')
-
         return inputs, targets
 
     def __len__(self):
@@ -6,9 +6,15 @@ from torch.utils.data import Dataset
 
 
 class PhysFormerDataset(Dataset):
-    def __init__(self, video_data, label_data, average_hr, target_length):
+    def __init__(self, video_data, label_data, average_hr, target_length, normalize_clip=False,
+                 video_scale=None, video_offset=None):
         self.transform = transforms.Compose([transforms.ToTensor()])
-        self.video_data = (video_data - 0.5) * 2
+        # video_data may be a read-only strided view of overlapping clips, so it is never modified in place
+        self.video_data = video_data
+        self.normalize_clip = normalize_clip
+        # per-frame scale/offset of uint8 clips (compact_storage)
+        self.video_scale = video_scale
+        self.video_offset = video_offset
         # self.video_data = (np.reshape(video_data, (-1, target_length, video_data.shape[2], video_data.shape[3], 3))-0.5)*2
         average_hr = [x if x > 40. else 40. for x in average_hr]
         average_hr = [x if x < 180. else 180. for x in average_hr]
@@ -24,15 +30,17 @@ class PhysFormerDataset(Dataset):
         #                        (np.max(self.video_data[idx]) - np.min(self.video_data[idx]))
         # video 크기 확인@@@@
         # video_data = torch.tensor(np.transpose(zerotoone_video_data, (3, 0, 1, 2)), dtype=torch.float32)
-        video_data = torch.tensor(np.transpose(self.video_data[idx], (3, 0, 1, 2)), dtype=torch.float32)
+        video_chunk = self.video_data[idx]
+        if self.video_scale is not None:
+            video_chunk = (video_chunk * self.video_scale[idx][:, None, None, None]
+                           + self.video_offset[idx][:, None, None, None])
+        if self.normalize_clip:
+            video_chunk = (video_chunk - np.mean(video_chunk)) / np.std(video_chunk)
+        video_chunk = (video_chunk - 0.5) * 2
+        video_data = torch.tensor(np.transpose(video_chunk, (3, 0, 1, 2)), dtype=torch.float32)
         label_data = torch.tensor(self.label_data[idx], dtype=torch.float32)
         average_hr = torch.tensor(self.average_hr[idx], dtype=torch.float32)
 
-        if torch.cuda.is_available():
-            video_data = video_data.to('cuda')
-            label_data = label_data.to('cuda')
-            average_hr = average_hr.to('cuda')
-
         return video_data, label_data, average_hr
 
     def __len__(self):
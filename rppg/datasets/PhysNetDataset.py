@@ -5,22 +5,32 @@ from torch.utils.data import Dataset
 
 
 class PhysNetDataset(Dataset):
-    def __init__(self, video_data, label_data, target_length):
+    def __init__(self, video_data, label_data, target_length, normalize_clip=False,
+                 video_scale=None, video_offset=None):
         # assert np.abs(1.0 - np.max(video_data)) < 0.2, 'Video data is not normalized 0~1'
         # assert np.abs(np.min(video_data) - 0.0) < 0.2, 'Video data is not normalized 0~1'
-        self.video_data = (video_data - 0.5) * 2
+        # video_data may be a read-only strided view of overlapping clips, so it is never modified in place
+        self.video_data = video_data
         self.label_data = label_data
+        self.normalize_clip = normalize_clip
+        # uint8 clips are dequantized per clip with their per-frame scale and offset
+        self.video_scale = video_scale
+        self.video_offset = video_offset
 
     def __getitem__(self, index):
         if torch.is_tensor(index):
             index = index.tolist()
 
-        video_data = torch.tensor(np.transpose(self.video_data[index], (3, 0, 1, 2)), dtype=torch.float32)
-        label_data = torch.tensor(self.label_data[index], dtype=torch.float32)
+        video_chunk = self.video_data[index]
+        if self.video_scale is not None:
+            video_chunk = (video_chunk * self.video_scale[index][:, None, None, None]
+                           + self.video_offset[index][:, None, None, None])
+        if self.normalize_clip:
+            video_chunk = (video_chunk - np.mean(video_chunk)) / np.std(video_chunk)
+        video_chunk = (video_chunk - 0.5) * 2
 
-        if torch.cuda.is_available():
-            video_data = video_data.to('cuda')
-            label_data = label_data.to('cuda')
+        video_data = torch.tensor(np.transpose(video_chunk, (3, 0, 1, 2)), dtype=torch.float32)
+        label_data = torch.tensor(self.label_data[index], dtype=torch.float32)
 
         # label_data = (label_data - torch.mean(label_data)) / torch.std(label_data)
 
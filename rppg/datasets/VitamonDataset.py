@@ -16,10 +16,6 @@ class VitamonDataset(Dataset):
         video_data = torch.tensor(self.video_data[index], dtype=torch.float32)
         label_data = torch.tensor(self.label[index], dtype=torch.float32)
 
-        if torch.cuda.is_available():
-            video_data = video_data.to('cuda')
-            label_data = label_data.to('cuda')
-
         return video_data, label_data
 
     def __len__(self):
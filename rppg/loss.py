@@ -158,7 +158,6 @@ class RhythmNetLoss(nn.Module):
         self.lambd = weight
         self.gru_outputs_considered = None
         self.custom_loss = RhythmNet_autograd()
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
     def forward(self, resnet_outputs, gru_outputs, target):
         frame_rate = 25.0
@@ -172,7 +171,7 @@ class RhythmNetLoss(nn.Module):
 
     # Need to write backward pass for this loss function
     def smooth_loss(self, gru_outputs):
-        smooth_loss = torch.zeros(1).to(device=self.device)
+        smooth_loss = torch.zeros(1, device=gru_outputs.device)
         self.gru_outputs_considered = gru_outputs.flatten()
         # hr_mean = self.gru_outputs_considered.mean()
         for hr_t in self.gru_outputs_considered:
@@ -220,7 +219,7 @@ class RhythmNet_autograd(torch.autograd.Function):
         with respect to the output, and we need to compute the gradient of the loss
         with respect to the input.
         """
-        output = torch.zeros(1).to('cuda')
+        output = torch.zeros(1).to(grad_output.device)
 
         hr_t, = ctx.saved_tensors
         hr_outs = ctx.hr_outs
@@ -515,7 +514,7 @@ class CurriculumLearningGuidedDynamicLoss(nn.Module):
         super(CurriculumLearningGuidedDynamicLoss, self).__init__()
         # self.predicted_rppg, self.target_rppg, self.average_hr = predicted_rppg, target_rppg, average_hr
         self.fs, self.std = 30, 1.0
-        self.bpm_range = torch.arange(40, 180, dtype=torch.float).cuda()
+        self.bpm_range = torch.arange(40, 180, dtype=torch.float)
 
         self.temporal_loss = 1.0
         self.batch_size = 0
@@ -556,11 +555,11 @@ class CurriculumLearningGuidedDynamicLoss(nn.Module):
         n = rppg.size()[1]
         unit_per_hz = self.fs / n
         feasible_bpm = self.bpm_range / 60.0
-        k = (feasible_bpm / unit_per_hz).type(torch.FloatTensor).cuda().view(1, -1, 1)
+        k = (feasible_bpm / unit_per_hz).type(torch.FloatTensor).to(rppg.device).view(1, -1, 1)
         two_pi_n_over_N = (Variable(2 * math.pi * torch.arange(0, n, dtype=torch.float32),
-                                    requires_grad=True) / n).cuda().view(1, 1, -1)
+                                    requires_grad=True) / n).to(rppg.device).view(1, 1, -1)
         hanning = (Variable(torch.from_numpy(np.hanning(n)).type(torch.FloatTensor),
-                            requires_grad=True).view(1, -1)).cuda()
+                            requires_grad=True).view(1, -1)).to(rppg.device)
         hanning_rppg = (rppg * hanning).view(self.batch_size, 1, -1)  # (batch, 1, time length)
 
         complex_absolute = torch.sum(hanning_rppg * torch.sin(k * two_pi_n_over_N), dim=-1) ** 2 + \
@@ -589,7 +588,7 @@ class CurriculumLearningGuidedDynamicLoss(nn.Module):
                 target_distribution.append(math.exp(-(i - int(hr[b])) ** 2 / (2 * self.std ** 2)) /
                                            (math.sqrt(2 * math.pi) * self.std))
             target_distribution = [i if i > 1e-15 else 1e-15 for i in target_distribution]
-            target_distribution = torch.Tensor(target_distribution).cuda()
+            target_distribution = torch.Tensor(target_distribution).to(softmax.device)
 
             frequency_distribution = F.log_softmax(softmax[b].view(-1))
             label_distribution_loss += self.kl_loss(frequency_distribution, target_distribution)
@@ -1,3 +1,4 @@
+import torch
 import torchinfo
 
 from rppg.log import log_warning, log_info
@@ -95,7 +96,8 @@ def get_model(fit_cfg):
         log_warning("pls implemented model")
         raise NotImplementedError("implement a custom model(%s)" % model_name)
 
-    return model.cuda()
+    device = torch.device(fit_cfg.device if torch.cuda.is_available() else 'cpu')
+    return model.to(device)
 
 
 def summary(model_name, model):
@@ -1,9 +1,5 @@
 import torch
 
-device = torch.device(
-    "cuda:0" if torch.cuda.is_available() else "cpu"
-)
-
 class DeepPhys(torch.nn.Module):
     def __init__(self):
         super().__init__()
@@ -4,8 +4,6 @@ class ETArPPGNet(torch.nn.Module):
     def __init__(self, length=300):
         super(ETArPPGNet, self).__init__()
         self.subnet = ETArPPGSubNet()
-        if torch.cuda.is_available():
-            self.subnet = self.subnet.to('cuda')
         self.length = length
         # define ETA-rPPGNet layers
         self.etarppgnet = torch.nn.Sequential(
@@ -19,8 +17,6 @@ class ETArPPGNet(torch.nn.Module):
 
     def forward(self, x):
         x = self.subnet.forward(x)
-        if torch.cuda.is_available():
-            x = x.to('cuda')
         x = self.etarppgnet(x)
         return x.view(-1, self.length)
 
@@ -1,7 +1,6 @@
 import torch
 import torchvision.transforms.functional as TF
 
-device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
 class JAMSNet(torch.nn.Module):
     def __init__(self):
@@ -33,7 +32,7 @@ class JAMSNet(torch.nn.Module):
         for _ in range(num_levels -1):
             h = h//2
             w = w//2
-            pyramid.append(torch.zeros(batch,length,channel, h, w).to(device))
+            pyramid.append(torch.zeros(batch,length,channel, h, w, device=video.device))
 
         for i, frame in enumerate(video):
             for j in range(num_levels - 1):
@@ -127,7 +126,7 @@ class LWAF(torch.nn.Module): # Layer-wise Attention Fusion
         self.conv = torch.nn.Conv2d(1,1,1,1,0)
         self.adaptive_avg_pool = torch.nn.AdaptiveAvgPool2d((48,32))
     def forward(self,x):
-        L = torch.zeros((1, 1, len(x))).to(device)
+        L = torch.zeros((1, 1, len(x)), device=x[0].device)
         L[:,:,0] = torch.mean(x[0])
         L[:,:,1] = torch.mean(x[1])
         L[:,:,2] = torch.mean(x[2])
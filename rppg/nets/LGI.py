@@ -19,7 +19,7 @@ class LGI(torch.nn.Module):
             S = U[:, :, 0]
             S = torch.unsqueeze(S, 2)  # 변환된 부분: np.expand_dims 대신 torch.unsqueeze 사용
             sst = torch.matmul(S, torch.transpose(S, 1, 2))  # 변환된 부분: np.swapaxes 대신 torch.transpose 사용
-            p = torch.tile(torch.eye(3), (S.shape[0], 1, 1)).to("cuda") # 변환된 부분: np.tile 대신 torch.tile 사용
+            p = torch.tile(torch.eye(3), (S.shape[0], 1, 1)).to(S.device) # 변환된 부분: np.tile 대신 torch.tile 사용
             P = p - sst
             Y = torch.matmul(P, X)
             bvp.append(Y[:, 1, :])
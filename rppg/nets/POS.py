@@ -16,7 +16,7 @@ class POS(torch.nn.Module):
         x = torch.mean(x, dim=(3, 4))
 
         batch_size, N, num_features = x.shape
-        H = torch.zeros(batch_size, 1, N).to("cuda")
+        H = torch.zeros(batch_size, 1, N).to(x.device)
 
         for b in range(batch_size):
             RGB = x[b]  # Assume RGB preprocessing already done
@@ -28,7 +28,7 @@ class POS(torch.nn.Module):
                 if m >= 0:
                     Cn = RGB[m:n, :] / torch.mean(RGB[m:n, :], dim=0)
                     Cn = torch.transpose(Cn, 0, 1)
-                    S = torch.matmul(torch.tensor([[0, 1, -1], [-2, 1, 1]], dtype=torch.float).to("cuda"), Cn)
+                    S = torch.matmul(torch.tensor([[0, 1, -1], [-2, 1, 1]], dtype=torch.float).to(x.device), Cn)
                     h = S[0, :] + (torch.std(S[0, :]) / torch.std(S[1, :])) * S[1, :]
                     mean_h = torch.mean(h)
                     h = h - mean_h
@@ -0,0 +1,130 @@
+import json
+import os
+import socket
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from rppg.log import log_warning
+
+# claim files of a preprocessed directory, {dataset_path}/{dataset}/{type}/.claims
+CLAIM_DIR = '.claims'
+
+
+class FileClaims:
+    """
+        Claims on source videos, shared by preprocessing processes on one or several hosts that write the same
+        preprocessed directory (preprocess.common.shared_claims).
+
+        A claim is a lock file created with O_CREAT | O_EXCL, which is atomic on local filesystems and NFS, holding the
+        host and pid of its owner. The owner refreshes its mtime while the video is preprocessed; a claim that was not
+        refreshed for timeout seconds belongs to a dead process and is taken over. Keep the timeout well above the
+        clock skew between hosts.
+    """
+
+    def __init__(self, claim_dir, timeout=600.):
+        """
+        :param claim_dir: directory of the claim files, on the storage shared by every process
+        :param timeout: seconds without refresh after which a claim is stale
+        """
+        self.claim_dir = claim_dir
+        self.timeout = timeout
+        self.owner = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.refreshed = {}  # key -> time of the last refresh of the claims held here
+        os.makedirs(claim_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.claim_dir, quote(key, safe='') + '.claim')
+
+    def owner_of(self, key):
+        """
+        :return: 'host:pid' holding the claim, None if it is free
+        """
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)['owner']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def acquire(self, key):
+        """
+        :return: True if the claim was created (or a stale one taken over) by this process
+        """
+        path = self.path(key)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._expire(path):
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(owner=self.owner, time=time.strftime('%Y-%m-%d %H:%M:%S')), f)
+            self.refreshed[key] = time.time()
+            return True
+        return False
+
+    def _expire(self, path):
+        """
+        :return: True if the claim at path was stale and removed
+        """
+        try:
+            if time.time() - os.stat(path).st_mtime < self.timeout:
+                return False
+        except FileNotFoundError:
+            return True
+        # only one of the processes expiring the same claim succeeds in moving it away
+        stale_path = '%s.stale-%s' % (path, self.owner.replace(':', '-'))
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return True
+        if time.time() - os.stat(stale_path).st_mtime < self.timeout:
+            # another process expired it first and its fresh claim was moved, put it back
+            try:
+                os.link(stale_path, path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        log_warning("expired stale claim %s" % path)
+        return True
+
+    def refresh(self, keys):
+        """
+        Keeps the claims of keys alive, called regularly while they are processed (at most every timeout / 4 s).
+        """
+        now = time.time()
+        for key in keys:
+            if now - self.refreshed.get(key, 0.) < self.timeout / 4:
+                continue
+            try:
+                os.utime(self.path(key))
+                self.refreshed[key] = now
+            except FileNotFoundError:
+                log_warning("claim of %s was lost (expired by another process)" % key)
+                self.refreshed[key] = now
+
+    def release(self, key):
+        """
+        Removes the claim of key if this process still holds it.
+        """
+        self.refreshed.pop(key, None)
+        if self.owner_of(key) == self.owner:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def hold(self, key, poll=0.05):
+        """
+        Short critical section shared by every process, waits until the claim of key is acquired.
+        """
+        while not self.acquire(key):
+            time.sleep(poll)
+        try:
+            yield
+        finally:
+            self.release(key)
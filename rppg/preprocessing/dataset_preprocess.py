@@ -1,20 +1,28 @@
 import multiprocessing
 import os
+import queue
+import time
+import traceback
+from collections import deque
 import dlib
-import csv
-import json
 import h5py
-import scipy.io as sio
 
 import cv2
 import face_recognition
-import math
 import numpy as np
-import pandas as pd
-from scipy.interpolate import interp1d
-from rppg.utils.funcs import detrend, BPF, get_hrv
+from scipy.signal import lfilter
 from tqdm import tqdm
+from rppg.log import log_warning
 from rppg.utils.data_path import *
+from rppg.utils.hdf5_storage import HDF5VideoWriter, video_codec
+from rppg.preprocessing.diff_normalize import diff_normalize_video, diff_normalize_label
+from rppg.preprocessing.manifest import PreprocessManifest, MANIFEST_NAME
+from rppg.preprocessing.claims import FileClaims, CLAIM_DIR
+from rppg.preprocessing.face_track import StreamingBoxTrack, SparseDetector, FaceTrackCache, FACE_TRACK_DIR, \
+    crop_face, replay_detector, recording_detector
+from rppg.preprocessing.face_detectors import get_face_detector, face_detector_name, frame_batches
+from rppg.preprocessing.mat_reader import MatVideoReader
+from rppg.preprocessing.label_reader import read_label, get_hrv_label, label_sources, LabelCache, LABEL_DIR
 
 
 def check_preprocessed_data(cfg):
@@ -29,7 +37,7 @@ def check_preprocessed_data(cfg):
     #           '\n\tPlease check the image size in the config files.')
 
     if cfg.preprocess.flag:
-        if not os.path.exists(cfg.dataset_path + cfg.preprocess.train_dataset.name + "/" + cfg.preprocess.common.type):
+        if needs_preprocessing(cfg, cfg.preprocess.train_dataset.name, cfg.preprocess.common.type):
             print('Preprocessing train_dataset({}-{}) dataset...'
                   .format(cfg.preprocess.train_dataset.name, cfg.preprocess.common.type))
             print("Preprocess type: ", cfg.preprocess.common.type)
@@ -37,7 +45,7 @@ def check_preprocessed_data(cfg):
         else:
             print('Preprocessed {} data already exists.'.format(cfg.preprocess.train_dataset.name))
 
-        if not os.path.exists(cfg.dataset_path + cfg.preprocess.test_dataset.name + "/" + cfg.preprocess.common.type):
+        if needs_preprocessing(cfg, cfg.preprocess.test_dataset.name, cfg.preprocess.common.type):
             print('Preprocessing test_dataset({}-{}) dataset...'
                   .format(cfg.preprocess.train_dataset.name, cfg.preprocess.common.type))
             preprocessing(cfg=cfg, dataset=cfg.preprocess.test_dataset)
@@ -45,17 +53,19 @@ def check_preprocessed_data(cfg):
             print('Preprocessed {} data already exists.'.format(cfg.preprocess.test_dataset.name))
 
     else:
-        if not os.path.exists(cfg.dataset_path + cfg.fit.train.dataset + "/" + cfg.fit.type.upper()):
+        # DIFF models can read CONT files when fit.diff_from_cont is set
+        storage_type = 'CONT' if cfg.fit.type.upper() == 'DIFF' and cfg.fit.diff_from_cont else cfg.fit.type.upper()
+        if needs_preprocessing(cfg, cfg.fit.train.dataset, storage_type):
             print('Preprocessing train({}-{}) dataset...'.format(cfg.fit.train.dataset, cfg.fit.type))
             print("Preprocess type: ", cfg.preprocess.common.type)
-            if cfg.preprocess.common.type != cfg.fit.type:
-                cfg.preprocess.common.type = cfg.fit.type
+            if cfg.preprocess.common.type != storage_type:
+                cfg.preprocess.common.type = storage_type
                 # raise ValueError("dataset type in fit_cfg.preprocess and fit_cfg.fit are different")
             print("Preprocess train_dataset name: ", cfg.preprocess.train_dataset.name)
             if cfg.preprocess.train_dataset.name != cfg.fit.train.dataset:
                 cfg.preprocess.train_dataset.name = cfg.fit.train.dataset
                 # raise ValueError("train_dataset name in fit_cfg.preprocess and fit_cfg.fit are different")
-            if cfg.fit.img_size > cfg.preprocess.common.image_size:
+            if cfg.fit.img_size > max(image_sizes(cfg.preprocess.common.image_size)):
                 cfg.preprocess.common.image_size = cfg.fit.img_size
                 # print('*** Image size for model input is larger than the preprocessed image *** '
                 #       '\n\tPlease check the image size in the config files.')
@@ -63,17 +73,17 @@ def check_preprocessed_data(cfg):
         else:
             print('Preprocessed {} data already exists.'.format(cfg.fit.train.dataset))
 
-        if not os.path.exists(cfg.dataset_path + cfg.fit.test.dataset + "/" + cfg.fit.type.upper()):
+        if needs_preprocessing(cfg, cfg.fit.test.dataset, storage_type):
             print('Preprocessing test({}-{}) dataset...'.format(cfg.fit.test.dataset, cfg.fit.type))
             print("Preprocess type: ", cfg.preprocess.common.type)
-            if cfg.preprocess.common.type != cfg.fit.type:
-                cfg.preprocess.common.type = cfg.fit.type
+            if cfg.preprocess.common.type != storage_type:
+                cfg.preprocess.common.type = storage_type
                 # raise ValueError("dataset type in fit_cfg.preprocess and fit_cfg.fit are different")
             print("Preprocess test_dataset name: ", cfg.preprocess.test_dataset.name)
             if cfg.preprocess.test_dataset.name != cfg.fit.test.dataset:
                 cfg.preprocess.test_dataset.name = cfg.fit.test.dataset
                 # raise ValueError("test_dataset name in fit_cfg.preprocess and fit_cfg.fit are different")
-            if cfg.fit.img_size > cfg.preprocess.common.image_size:
+            if cfg.fit.img_size > max(image_sizes(cfg.preprocess.common.image_size)):
                 cfg.preprocess.common.image_size = cfg.fit.img_size
                 # print('*** Image size for model input is larger than the preprocessed image *** '
                 #       '\n\tPlease check the image size in the config files.')
@@ -82,6 +92,26 @@ def check_preprocessed_data(cfg):
             print('Preprocessed {} data already exists.'.format(cfg.fit.test.dataset))
 
 
+def needs_preprocessing(cfg, dataset_name, preprocess_type):
+    """
+    :return: True if the preprocessed directory is missing, or, with preprocess.common.incremental, if the raw dataset
+             is available to check the manifest for missing, stale or failed files
+    """
+    if not os.path.exists(cfg.dataset_path + dataset_name + "/" + preprocess_type):
+        return True
+    return cfg.preprocess.common.incremental and os.path.isdir(cfg.data_root_path + dataset_name)
+
+
+def image_sizes(image_size):
+    """
+    :param image_size: preprocess.common.image_size, one size or a list of sizes written in the same pass
+    :return: list of sizes, the first one is also stored as raw_video
+    """
+    if isinstance(image_size, (list, tuple)):
+        return [int(size) for size in image_size]
+    return [int(image_size)]
+
+
 def preprocessing(cfg, dataset):
     # def preprocessing(data_root_path, preprocess_cfg, dataset_path):
     """
@@ -92,8 +122,7 @@ def preprocessing(cfg, dataset):
     :return:
     """
 
-    chunk_size = cfg.preprocess.common.process_num
-    manager = multiprocessing.Manager()
+    num_workers = cfg.preprocess.common.process_num or os.cpu_count()
 
     if cfg.preprocess.common.type.upper() == 'CONT':
         preprocess_type = 'CONT'
@@ -102,13 +131,28 @@ def preprocessing(cfg, dataset):
     else:
         preprocess_type = 'CUSTOM'
 
-    img_size = cfg.preprocess.common.image_size
+    img_sizes = image_sizes(cfg.preprocess.common.image_size)
     large_box_coef = cfg.preprocess.common.larger_box_coef
+    single_pass = cfg.preprocess.common.single_pass
+    buffer_frames = cfg.preprocess.common.buffer_frames
+    detect_scale = cfg.preprocess.common.detect_scale
+    detect_stride = cfg.preprocess.common.detect_stride
+    detect_motion_threshold = cfg.preprocess.common.detect_motion_threshold
+    face_detect_algorithm = cfg.preprocess.common.face_detect_algorithm
+    face_track_cache = cfg.preprocess.common.face_track_cache
+    label_cache = cfg.preprocess.common.label_cache
+    chunk_frames = cfg.preprocess.common.storage.chunk_frames
+    compression = cfg.preprocess.common.storage.compression
+    codec = video_codec(cfg.preprocess.common.storage.codec)
+    codec_quality = cfg.preprocess.common.storage.codec_quality
+    if codec is not None and preprocess_type == 'DIFF':
+        # DIFF frames are normalized floats, only the uint8 face stream of CONT files can be encoded
+        log_warning("storage.codec only applies to CONT files, DIFF frames are stored as float32")
+        codec = None
 
     if not os.path.isdir(cfg.data_root_path + dataset.name):
         # os.makedirs(dataset_root_path)
         raise ValueError("dataset path does not exist, check data_root_path in config.yaml")
-    return_dict = manager.dict()
 
     RawDataPathLoader = None
     if dataset.name == "V4V":
@@ -162,20 +206,58 @@ def preprocessing(cfg, dataset):
         vid_name = RawDataPathLoader.video_name
         ground_truth_name = RawDataPathLoader.ppg_name
 
-    # multiprocessing
-    chunk_num = math.ceil(len(data_list) / chunk_size)
-    if chunk_num == 1:
-        chunk_size = len(data_list)
-    for i in range(chunk_num):
-        if i == chunk_num - 1:
-            chunk_data_list = data_list[i * chunk_size:]
-        else:
-            chunk_data_list = data_list[i * chunk_size:(i + 1) * chunk_size]
+    # only files that are missing, stale or failed in the manifest are (re)processed
+    params = dict(type=preprocess_type, image_size=img_sizes if len(img_sizes) > 1 else img_sizes[0],
+                  larger_box_coef=large_box_coef, single_pass=single_pass, detect_scale=detect_scale,
+                  detect_stride=detect_stride, detect_motion_threshold=detect_motion_threshold)
+    if face_detector_name(face_detect_algorithm) != 'hog':
+        # hog stays implicit so manifests written before the detector registry remain current
+        params['face_detect_algorithm'] = face_detect_algorithm
+    if codec is not None:
+        params['codec'] = codec if codec == 'png' else '%s-%d' % (codec, codec_quality)
+    # with shared_claims several preprocessing processes (on one or many hosts) split the files of the same
+    # preprocessed directory: each file is claimed before it is processed and the manifest is merged on every save
+    claims = None
+    if cfg.preprocess.common.shared_claims:
+        claims = FileClaims(os.path.join(cfg.dataset_path, dataset.name, preprocess_type, CLAIM_DIR),
+                            cfg.preprocess.common.claim_timeout)
+    manifest = PreprocessManifest(os.path.join(cfg.dataset_path, dataset.name, preprocess_type, MANIFEST_NAME),
+                                  lock=claims)
+    snapshot = dict(manifest.entries)
+    sources = {}
+    for data_path in data_list:
+        video_path, label_path = get_source_paths(dataset.name, dataset_root_path, data_path, vid_name,
+                                                  ground_truth_name)
+        if video_path.__contains__("png"):
+            video_path = video_path[:-4]
+        sources[data_path] = manifest.source_stat([video_path] + label_sources(label_path))
+    outputs = {data_path: get_output_path(cfg.dataset_path, dataset.name, preprocess_type, data_path)
+               for data_path in data_list}
+    todo_list = [data_path for data_path in data_list
+                 if not manifest.is_current(data_path, sources[data_path], params, outputs[data_path])]
+    manifest.save()
+    print("{}: {}/{} files up to date, {} to preprocess".format(dataset.name, len(data_list) - len(todo_list),
+                                                                len(data_list), len(todo_list)))
+    if not todo_list:
+        return
+
+    def on_result(data_path, error):
+        manifest.update(data_path, sources[data_path], params, outputs[data_path],
+                        'done' if error is None else 'failed', error)
 
-        print("chunk_data_list : ", chunk_data_list)
+    def handled_elsewhere(data_path):
+        # another process recorded the file in the shared manifest since this run read it
+        entry = PreprocessManifest(manifest.path).entries.get(data_path)
+        return entry is not None and entry != snapshot.get(data_path)
 
-        chunk_preprocessing(preprocess_type, chunk_data_list, dataset_root_path, vid_name, ground_truth_name,
-                            dataset.name, cfg.dataset_path, img_size=img_size, large_box_coef=large_box_coef)
+    pool_preprocessing(preprocess_type, todo_list, dataset_root_path, vid_name, ground_truth_name, num_workers,
+                       on_result=on_result, claims=claims, handled_elsewhere=handled_elsewhere, save_root_path=cfg.dataset_path, dataset_name=dataset.name,
+                       img_sizes=img_sizes, large_box_coef=large_box_coef, single_pass=single_pass,
+                       buffer_frames=buffer_frames, face_detect_algorithm=face_detect_algorithm,
+                       detect_scale=detect_scale, detect_stride=detect_stride,
+                       detect_motion_threshold=detect_motion_threshold, face_track_cache=face_track_cache,
+                       label_cache=label_cache, chunk_frames=chunk_frames, compression=compression, codec=codec,
+                       codec_quality=codec_quality)
 
 
 def mkdir_p(directory):
@@ -191,19 +273,59 @@ def mkdir_p(directory):
     os.mkdir(directory)
 
 
-def preprocess_Dataset(preprocess_type, dataset_root_path, data_path, vid_name, ground_truth_name, return_dict,
-                       **kwargs):
+def preprocess_Dataset(preprocess_type, dataset_root_path, data_path, vid_name, ground_truth_name, **kwargs):
     """
     :param path: dataset path
     :param flag: face detect flag
     :param model_name: select preprocessing method
-    :param return_dict: : preprocessed image, label
     """
 
     save_root_path = kwargs['save_root_path']
     dataset_name = kwargs['dataset_name']
-    img_size = kwargs['img_size']
 
+    img_sizes = kwargs['img_sizes']
+    chunk_frames = kwargs['chunk_frames']
+
+    video_path, label_path = get_source_paths(dataset_name, dataset_root_path, data_path, vid_name, ground_truth_name)
+    output_path = get_output_path(save_root_path, dataset_name, preprocess_type, data_path)
+    if not os.path.isdir(os.path.dirname(output_path)):
+        mkdir_p(os.path.dirname(output_path))
+    # detected boxes and parsed labels are shared by every preprocessing type and crop setting
+    face_track_path = None
+    if kwargs['face_track_cache']:
+        face_track_path = get_output_path(save_root_path, dataset_name, FACE_TRACK_DIR, data_path)[:-5] + '.npz'
+    label_cache_path = None
+    if kwargs['label_cache']:
+        label_cache_path = get_output_path(save_root_path, dataset_name, LABEL_DIR, data_path)[:-5] + '.npz'
+
+    # frames are appended to the hdf5 file as they are cropped, the file only appears once it is complete;
+    # every size in img_sizes is resized from the same crop and written to the same file
+    if preprocess_type == 'DIFF':
+        # DIFF normalization needs statistics of the whole video: the crops go to an uncompressed scratch file
+        # first and are normalized from it block by block, one chunk per block
+        with HDF5VideoWriter(output_path + '.cont', chunk_frames, None) as cont_writer:
+            cont = cont_writer.create_videos(img_sizes, 3)
+            raw_label, hrv = data_preprocess(preprocess_type, video_path, label_path, cont, face_track_path,
+                                             label_cache_path, os.path.dirname(output_path), **kwargs)
+            with HDF5VideoWriter(output_path, chunk_frames, kwargs['compression']) as writer:
+                for img_size, video in writer.create_videos(img_sizes, 6).items():
+                    cont[img_size].flush()
+                    video.resize(len(cont[img_size]))
+                    diff_normalize_video(cont[img_size].dataset, block_size=writer.chunk_frames, out=video.dataset)
+                writer.commit(preprocessed_label=diff_normalize_label(raw_label), hrv=hrv)
+    else:
+        with HDF5VideoWriter(output_path, chunk_frames, kwargs['compression'], kwargs['codec'],
+                             kwargs['codec_quality']) as writer:
+            videos = writer.create_videos(img_sizes, 3)
+            raw_label, hrv = data_preprocess(preprocess_type, video_path, label_path, videos, face_track_path,
+                                             label_cache_path, os.path.dirname(output_path), **kwargs)
+            writer.commit(preprocessed_label=raw_label, hrv=hrv)
+
+
+def get_source_paths(dataset_name, dataset_root_path, data_path, vid_name, ground_truth_name):
+    """
+    :return: video path and label path of a source video
+    """
     if dataset_name == "UBFC_Phys":
         data_path = data_path.split('/')
         video_path = dataset_root_path + '/' + data_path[-2] + '/' + 'vid_' + data_path[-1] + vid_name
@@ -211,15 +333,14 @@ def preprocess_Dataset(preprocess_type, dataset_root_path, data_path, vid_name,
     else:
         video_path = dataset_root_path + data_path + vid_name
         label_path = dataset_root_path + data_path + ground_truth_name
+    return video_path, label_path
 
-    raw_video, preprocessed_label, hrv = data_preprocess(preprocess_type, video_path, label_path, **kwargs)
-    # raw_video, preprocessed_label, hrv = [1], 2, 3  # For Debug
-
-    if None in raw_video:
-        return
 
+def get_output_path(save_root_path, dataset_name, preprocess_type, data_path):
+    """
+    :return: preprocessed hdf5 file path of a source video
+    """
     add_info = ''
-
     if dataset_name == "VIPL_HR":
         data_path = data_path.split('/')
         add_info = data_path[-3] + "/" + data_path[-2] + "/"
@@ -229,354 +350,402 @@ def preprocess_Dataset(preprocess_type, dataset_root_path, data_path, vid_name,
         add_info = data_path[-2] + "/"
         data_path = data_path[-1]
     if dataset_name == "UBFC_Phys":
+        data_path = data_path.split('/')
         add_info = data_path[-2] + "/"
         data_path = data_path[-1]
 
     dir_path = save_root_path + "/" + dataset_name + "/" + preprocess_type + "/" + add_info
-    if not os.path.isdir(dir_path):
-        mkdir_p(dir_path)
-
-    data = h5py.File(dir_path + data_path + ".hdf5", "w")
-    data.create_dataset('raw_video', data=raw_video)
-    data.create_dataset('preprocessed_label', data=preprocessed_label)
-    data.create_dataset('hrv', data=hrv)
-    data.close()
-
-
-def chunk_preprocessing(preprocess_type, data_list, dataset_root_path, vid_name, ground_truth_name, dataset_name,
-                        dataset_path, img_size, large_box_coef):
-    process = []
-    save_root_path = dataset_path
-
-    manager = multiprocessing.Manager()
-    return_dict = manager.dict()
-
-    for index, data_path in enumerate(data_list):
-        proc = multiprocessing.Process(target=preprocess_Dataset,
-                                       args=(preprocess_type, dataset_root_path, data_path, vid_name,
-                                             ground_truth_name, return_dict)
-                                       , kwargs={"save_root_path": save_root_path,
-                                                 "dataset_name": dataset_name,
-                                                 "img_size": img_size,
-                                                 "large_box_coef": large_box_coef})
+    return dir_path + data_path + ".hdf5"
 
-        process.append(proc)
-        proc.start()
-    for proc in process:
-        proc.join()
 
-    manager.shutdown()
-
-
-def data_preprocess(preprocess_type, video_path, label_path, **kwargs):
-    img_size = kwargs['img_size']
+def pool_preprocessing(preprocess_type, data_list, dataset_root_path, vid_name, ground_truth_name, num_workers,
+                       on_result=None, claims=None, handled_elsewhere=None, **kwargs):
+    """
+    Preprocesses data_list with a fixed number of worker processes, every worker is handed the next video as soon
+    as it is done with the previous one. Failures, including crashed workers, are reported per file and do not stop
+    the other videos.
+
+    :param num_workers: number of worker processes
+    :param on_result: called in this process with (data_path, error message or None) when a file is finished
+    :param claims: FileClaims shared with other preprocessing processes, None if this process is the only one.
+                   A file is handed to a worker once it is claimed and released after on_result; files claimed
+                   elsewhere are retried until they are handled there or their claim expires
+    :param handled_elsewhere: data_path -> True if another process finished (or failed) the file meanwhile
+    :param kwargs: preprocess_Dataset keyword arguments
+    :return: list of (data_path, error message) of the failed files
+    """
+    result_queue = multiprocessing.Queue()
+    data_list = list(dict.fromkeys(data_list))
+    num_workers = max(1, min(num_workers, len(data_list)))
+    # every worker has its own task queue and gets one file at a time, so the parent always knows which file a
+    # worker holds and a file is only claimed right before it is processed
+    pending = deque(data_list)
+    deferred = {}  # data_path claimed by another process -> time of the next claim attempt
+    retry_interval = min(30., claims.timeout / 4) if claims is not None else 0.
+    workers = {}  # worker index -> (process, task queue)
+    assigned = {}  # worker index -> data_path it is processing
+    elsewhere = []
+    failed = []
+
+    def start_worker(index):
+        task_queue = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=preprocess_worker,
+                                         args=(task_queue, result_queue, preprocess_type, dataset_root_path,
+                                               vid_name, ground_truth_name), kwargs=kwargs)
+        worker.start()
+        workers[index] = (worker, task_queue)
+
+    def finish(pbar, data_path, error):
+        if error is not None:
+            failed.append((data_path, error))
+        if on_result is not None:
+            on_result(data_path, error)
+        # the result is recorded before the claim is released, the next claimant sees the file as handled
+        if claims is not None:
+            claims.release(data_path)
+        pbar.update(1)
+
+    def dispatch(pbar):
+        now = time.time()
+        for data_path, retry_time in list(deferred.items()):
+            if retry_time <= now:
+                del deferred[data_path]
+                pending.append(data_path)
+        idle = [index for index in workers if index not in assigned]
+        while pending and idle:
+            data_path = pending.popleft()
+            if claims is not None:
+                if handled_elsewhere is not None and handled_elsewhere(data_path):
+                    elsewhere.append(data_path)
+                    pbar.update(1)
+                    continue
+                if not claims.acquire(data_path):
+                    deferred[data_path] = now + retry_interval
+                    continue
+                if handled_elsewhere is not None and handled_elsewhere(data_path):
+                    # finished by the previous claimant between the check and the claim
+                    claims.release(data_path)
+                    elsewhere.append(data_path)
+                    pbar.update(1)
+                    continue
+            index = idle.pop()
+            assigned[index] = data_path
+            workers[index][1].put(data_path)
+
+    def handle(pbar, status, data_path, info):
+        index = next((index for index, path in assigned.items() if path == data_path), None)
+        if index is None:
+            # already failed because its worker died after sending the result
+            return
+        del assigned[index]
+        if status == 'failed':
+            log_warning("Preprocessing failed: %s\n%s" % (data_path, info))
+        finish(pbar, data_path, info)
+
+    for index in range(num_workers):
+        start_worker(index)
+    with tqdm(total=len(data_list), desc=kwargs['dataset_name'], position=0, leave=True) as pbar:
+        dispatch(pbar)
+        while assigned or pending or deferred:
+            if claims is not None:
+                claims.refresh(assigned.values())
+            try:
+                handle(pbar, *result_queue.get(timeout=1.))
+                while True:
+                    handle(pbar, *result_queue.get_nowait())
+            except queue.Empty:
+                pass
+            # a worker killed while preprocessing (e.g. out of memory) never reports back
+            for index, (worker, _) in list(workers.items()):
+                if worker.is_alive():
+                    continue
+                if index in assigned:
+                    data_path = assigned.pop(index)
+                    log_warning("Preprocessing failed: %s (worker exited with code %s)" % (data_path, worker.exitcode))
+                    finish(pbar, data_path, "worker exited with code %s" % worker.exitcode)
+                start_worker(index)
+            dispatch(pbar)
+
+    for _, task_queue in workers.values():
+        task_queue.put(None)
+    for worker, _ in workers.values():
+        worker.join()
+    if elsewhere:
+        print("%d/%d files were preprocessed by other processes" % (len(elsewhere), len(data_list)))
+    if failed:
+        log_warning("%d/%d files failed: %s" % (len(failed), len(data_list), [data_path for data_path, _ in failed]))
+    return failed
+
+
+def preprocess_worker(task_queue, result_queue, preprocess_type, dataset_root_path, vid_name, ground_truth_name,
+                      **kwargs):
+    while True:
+        data_path = task_queue.get()
+        if data_path is None:
+            break
+        try:
+            preprocess_Dataset(preprocess_type, dataset_root_path, data_path, vid_name, ground_truth_name, **kwargs)
+            result_queue.put(('done', data_path, None))
+        except Exception:
+            result_queue.put(('failed', data_path, traceback.format_exc()))
+
+
+def data_preprocess(preprocess_type, video_path, label_path, videos, face_track_path=None, label_cache_path=None,
+                    scratch_dir=None, **kwargs):
+    """
+    :param videos: dict img_size -> VideoStream the cropped CONT frames are appended to, in order
+    :param face_track_path: FaceTrackCache sidecar of the source, None to always detect
+    :param label_cache_path: LabelCache sidecar of the source, None to always parse the labels
+    :param scratch_dir: directory of temporary files (the frame-major copy of .mat videos), None for the temp directory
+    :return: label and hrv of the frames written
+    """
     large_box_coef = kwargs['large_box_coef']
-    # detection_model = 'cnn' if dlib.DLIB_USE_CUDA else 'hog'
-    detection_model = 'hog'
-    xy_points = pd.DataFrame(columns=['bottom', 'right', 'top', 'left'])
+    detector = get_face_detector(kwargs['face_detect_algorithm'], scale=kwargs['detect_scale'])
+    detector_settings = dict(detector.settings, detect_stride=kwargs['detect_stride'],
+                             detect_motion_threshold=kwargs['detect_motion_threshold'])
+
+    def face_track(source_path, frame_total):
+        """
+        :return: FaceTrackCache (None if disabled), face locations (bottom, right, top, left) per frame with NaN
+                 where no face is detected, detector filling them (replaying them if they were cached), cache hit
+        """
+        cache = FaceTrackCache(face_track_path, source_path, detector_settings) if face_track_path else None
+        cached = cache.load() if cache is not None else None
+        if cached is not None:
+            return cache, cached[0], replay_detector(cached[0]), True
+        xy_points = np.full((frame_total, 4), np.nan)
+        detect = SparseDetector(detector, kwargs['detect_stride'], kwargs['detect_motion_threshold'], frame_total)
+        return cache, xy_points, recording_detector(detect, xy_points), False
+
+    def detect_faces(frames, frame_total, detect, xy_points, desc):
+        frames = tqdm(frames, total=frame_total, position=0, leave=True, desc=desc)
+        if detector.batch_size == 1 or kwargs['detect_stride'] > 1 or kwargs['detect_motion_threshold'] > 0:
+            for frame in frames:
+                detect(frame)
+            return
+        # every frame is a keyframe, batches go straight to the detector
+        frame_idx = 0
+        for batch in frame_batches(frames, detector.batch_size):
+            for box, _ in detector.detect(batch):
+                if box is not None:
+                    xy_points[frame_idx] = box
+                frame_idx += 1
 
     # for PURE dataset
     if video_path.__contains__("png"):
         path = video_path[:-4]
         data = sorted(os.listdir(path))[1:]
         frame_total = len(data)
-        raw_label = get_label(label_path, frame_total)
-        hrv = get_hrv_label(raw_label, fs=30.)
-
-        for i in tqdm(range(frame_total), position=0, leave=True, desc=path):
-            frame = cv2.imread(path + "/" + data[i])
-            face_locations = face_recognition.face_locations(frame, 1, model=detection_model)
-            if len(face_locations) >= 1:
-                xy_points.loc[i] = face_locations[0]
-            else:
-                xy_points.loc[i] = (np.NaN, np.NaN, np.NaN, np.NaN)
-
-        valid_fr_idx = xy_points[xy_points['top'].notnull()].index.tolist()
-        front_idx = valid_fr_idx[0]
-        rear_idx = valid_fr_idx[-1]
-
-        xy_points = xy_points[front_idx:rear_idx + 1]
-        raw_label = raw_label[front_idx:rear_idx + 1]
-        hrv = hrv[front_idx:rear_idx + 1]
-
-        y_x_w = get_CntYX_Width(xy_points=xy_points, large_box_coef=large_box_coef)
-
-        raw_video = np.empty((xy_points.__len__(), img_size, img_size, 3))
-        for i, frame_num in enumerate(range(front_idx, rear_idx + 1)):
-            frame = cv2.imread(path + "/" + data[frame_num])
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face = np.take(frame, range(y_x_w[i][0] - y_x_w[i][2],
-                                        y_x_w[i][0] + y_x_w[i][2]), 0, mode='clip')
-            face = np.take(face, range(y_x_w[i][1] - y_x_w[i][2],
-                                       y_x_w[i][1] + y_x_w[i][2]), 1, mode='clip')
-            face = (face / 255.).astype(np.float32)
-            if img_size == y_x_w[frame_num][2] * 2:
-                raw_video[i] = face
-            else:
-                raw_video[i] = cv2.resize(face, (img_size, img_size), interpolation=cv2.INTER_AREA)
+        raw_label, hrv = read_label(label_path, frame_total, fs=30., cache_path=label_cache_path)
+        cache, xy_points, detect, cached = face_track(path, frame_total)
+
+        if kwargs['single_pass']:
+            frames = (cv2.imread(path + "/" + name) for name in data)
+            front_idx, rear_idx = single_pass_crop(frames, frame_total, detect, videos, large_box_coef,
+                                                   kwargs['buffer_frames'], desc=path)
+            if cache is not None and not cached:
+                cache.save(xy_points, 30.)
+            raw_label = raw_label[front_idx:rear_idx + 1]
+            hrv = hrv[front_idx:rear_idx + 1]
+        else:
+            if not cached:
+                detect_faces((cv2.imread(path + "/" + name) for name in data), frame_total, detect, xy_points, path)
+                if cache is not None:
+                    cache.save(xy_points, 30.)
+
+            valid_fr_idx = np.flatnonzero(~np.isnan(xy_points[:, 2]))
+            front_idx = valid_fr_idx[0]
+            rear_idx = valid_fr_idx[-1]
+
+            xy_points = xy_points[front_idx:rear_idx + 1]
+            raw_label = raw_label[front_idx:rear_idx + 1]
+            hrv = hrv[front_idx:rear_idx + 1]
+
+            y_x_w = get_CntYX_Width(xy_points=xy_points, large_box_coef=large_box_coef)
+
+            for i, frame_num in enumerate(range(front_idx, rear_idx + 1)):
+                frame = cv2.imread(path + "/" + data[frame_num])
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                face = np.take(frame, range(y_x_w[i][0] - y_x_w[i][2],
+                                            y_x_w[i][0] + y_x_w[i][2]), 0, mode='clip')
+                face = np.take(face, range(y_x_w[i][1] - y_x_w[i][2],
+                                           y_x_w[i][1] + y_x_w[i][2]), 1, mode='clip')
+                face = (face / 255.).astype(np.float32)
+                append_face(videos, face)
 
     elif video_path.__contains__(".mat"):
-        f = sio.loadmat(video_path)
-        frames = f['video']
-        raw_label = f['GT_ppg']
-        frame_total = len(frames)
-        hrv = get_hrv_label(raw_label, fs=30.)
-
-        for i in tqdm(range(frame_total), position=0, leave=True, desc=video_path):
-            frame = frames[i]
-            face_locations = face_recognition.face_locations((frame * 255.).astype(np.uint8), 1, model=detection_model)
-            if len(face_locations) >= 1:
-                xy_points.loc[i] = face_locations[0]
-            else:
-                xy_points.loc[i] = (np.NaN, np.NaN, np.NaN, np.NaN)
-
-        valid_fr_idx = xy_points[xy_points['top'].notnull()].index.tolist()
-        front_idx = valid_fr_idx[0]
-        rear_idx = valid_fr_idx[-1]
-
-        xy_points = xy_points[front_idx:rear_idx + 1]
-        raw_label = raw_label[front_idx:rear_idx + 1]
-        hrv = hrv[front_idx:rear_idx + 1]
-        frames = frames[front_idx:rear_idx + 1]
-
-        y_x_w = get_CntYX_Width(xy_points=xy_points, large_box_coef=large_box_coef)
-
-        raw_video = np.empty((xy_points.__len__(), img_size, img_size, 3), dtype=np.float32)
-        for frame_num, frame in enumerate(frames):
-            face = np.take(frame, range(y_x_w[frame_num][0] - y_x_w[frame_num][2],
-                                        y_x_w[frame_num][0] + y_x_w[frame_num][2]), 0, mode='clip')
-            face = np.take(face, range(y_x_w[frame_num][1] - y_x_w[frame_num][2],
-                                       y_x_w[frame_num][1] + y_x_w[frame_num][2]), 1, mode='clip')
-            if img_size == y_x_w[frame_num][2] * 2:
-                raw_video[frame_num] = face
-            else:
-                raw_video[frame_num] = cv2.resize(face, (img_size, img_size), interpolation=cv2.INTER_AREA)
+        # frames are read in blocks for detection and again for cropping, the recording is never held in memory
+        with MatVideoReader(video_path, scratch_dir=scratch_dir) as reader:
+            labels = LabelCache(label_cache_path, [video_path])
+            raw_label = labels.get('ppg', lambda: reader.variable('GT_ppg').reshape(-1))
+            frame_total = len(reader)
+            hrv = labels.get('hrv_%g' % 30., lambda: get_hrv_label(raw_label, fs=30.))
+            labels.save()
+            cache, xy_points, detect, cached = face_track(video_path, frame_total)
+
+            if not cached:
+                detect_faces(((frame * 255.).astype(np.uint8) for frame in reader.frames()), frame_total, detect,
+                             xy_points, video_path)
+                if cache is not None:
+                    cache.save(xy_points, 30.)
+
+            valid_fr_idx = np.flatnonzero(~np.isnan(xy_points[:, 2]))
+            front_idx = valid_fr_idx[0]
+            rear_idx = valid_fr_idx[-1]
+
+            xy_points = xy_points[front_idx:rear_idx + 1]
+            raw_label = raw_label[front_idx:rear_idx + 1]
+            hrv = hrv[front_idx:rear_idx + 1]
+
+            y_x_w = get_CntYX_Width(xy_points=xy_points, large_box_coef=large_box_coef)
+
+            for frame_num, frame in enumerate(reader.frames(front_idx, rear_idx + 1)):
+                face = np.take(frame, range(y_x_w[frame_num][0] - y_x_w[frame_num][2],
+                                            y_x_w[frame_num][0] + y_x_w[frame_num][2]), 0, mode='clip')
+                face = np.take(face, range(y_x_w[frame_num][1] - y_x_w[frame_num][2],
+                                           y_x_w[frame_num][1] + y_x_w[frame_num][2]), 1, mode='clip')
+                append_face(videos, face)
     # for UBFC, VIPL-HR dataset
     else:
         cap = cv2.VideoCapture(video_path)
         frame_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        raw_label = get_label(label_path, frame_total)
-        hrv = get_hrv_label(raw_label, fs=30.)
-
-        for i in tqdm(range(frame_total), position=0, leave=True, desc=video_path):
-            ret, frame = cap.read()
-            if ret:
-                face_locations = face_recognition.face_locations(frame, 1, model=detection_model)
-                if len(face_locations) >= 1:
-                    xy_points.loc[i] = face_locations[0]
-                else:
-                    xy_points.loc[i] = (np.NaN, np.NaN, np.NaN, np.NaN)
-            else:
-                break
-        cap.release()
-
-        valid_fr_idx = xy_points[xy_points['top'].notnull()].index.tolist()
-        front_idx = valid_fr_idx[0]
-        rear_idx = valid_fr_idx[-1]
-
-        xy_points = xy_points[front_idx:rear_idx + 1]
-        raw_label = raw_label[front_idx:rear_idx + 1]
-        hrv = hrv[front_idx:rear_idx + 1]
-
-        y_x_w = get_CntYX_Width(xy_points=xy_points, large_box_coef=large_box_coef)
+        raw_label, hrv = read_label(label_path, frame_total, fs=30., cache_path=label_cache_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        cache, xy_points, detect, cached = face_track(video_path, frame_total)
+
+        if kwargs['single_pass']:
+            front_idx, rear_idx = single_pass_crop(read_frames(cap, frame_total), frame_total, detect, videos,
+                                                   large_box_coef, kwargs['buffer_frames'], desc=video_path)
+            cap.release()
+            if cache is not None and not cached:
+                cache.save(xy_points, fps)
+            raw_label = raw_label[front_idx:rear_idx + 1]
+            hrv = hrv[front_idx:rear_idx + 1]
+        else:
+            if not cached:
+                detect_faces(read_frames(cap, frame_total), frame_total, detect, xy_points, video_path)
+                if cache is not None:
+                    cache.save(xy_points, fps)
+            cap.release()
+
+            valid_fr_idx = np.flatnonzero(~np.isnan(xy_points[:, 2]))
+            front_idx = valid_fr_idx[0]
+            rear_idx = valid_fr_idx[-1]
+
+            xy_points = xy_points[front_idx:rear_idx + 1]
+            raw_label = raw_label[front_idx:rear_idx + 1]
+            hrv = hrv[front_idx:rear_idx + 1]
+
+            y_x_w = get_CntYX_Width(xy_points=xy_points, large_box_coef=large_box_coef)
+
+            cap = cv2.VideoCapture(video_path)
+            for _ in range(front_idx):
+                cap.read()
+
+            for frame_num in range(len(y_x_w)):
+                ret, frame = cap.read()
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                if not ret:
+                    print(f"Can't receive frame: {video_path}")
+                    break
+                # crop face from frame
+                face = np.take(frame, range(y_x_w[frame_num][0] - y_x_w[frame_num][2],
+                                            y_x_w[frame_num][0] + y_x_w[frame_num][2]), 0, mode='clip')
+                face = np.take(face, range(y_x_w[frame_num][1] - y_x_w[frame_num][2],
+                                           y_x_w[frame_num][1] + y_x_w[frame_num][2]), 1, mode='clip')
+                face = (face / 255.).astype(np.float32)
+                append_face(videos, face)
+            cap.release()
+    # whole-video transforms (DIFF normalization) are applied by preprocess_Dataset on the written frames
+    return raw_label, hrv
+
+
+def append_face(videos, face):
+    """
+    :param videos: dict img_size -> VideoStream
+    :param face: square face crop at box resolution, resized once for every size
+    """
+    for img_size, video in videos.items():
+        if face.shape[0] == img_size:
+            video.append(face)
+        else:
+            video.append(cv2.resize(face, (img_size, img_size), interpolation=cv2.INTER_AREA))
 
-        cap = cv2.VideoCapture(video_path)
-        for _ in range(front_idx):
-            cap.read()
 
-        raw_video = np.empty((xy_points.__len__(), img_size, img_size, 3), dtype=np.float32)
-        for frame_num in range(rear_idx + 1):
-            ret, frame = cap.read()
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            if not ret:
-                print(f"Can't receive frame: {video_path}")
-                break
-            # crop face from frame
-            face = np.take(frame, range(y_x_w[frame_num][0] - y_x_w[frame_num][2],
-                                        y_x_w[frame_num][0] + y_x_w[frame_num][2]), 0, mode='clip')
-            face = np.take(face, range(y_x_w[frame_num][1] - y_x_w[frame_num][2],
-                                       y_x_w[frame_num][1] + y_x_w[frame_num][2]), 1, mode='clip')
-            face = (face / 255.).astype(np.float32)
-            if img_size == y_x_w[frame_num][2] * 2:
-                raw_video[frame_num] = face
-            else:
-                raw_video[frame_num] = cv2.resize(face, (img_size, img_size), interpolation=cv2.INTER_AREA)
-        cap.release()
-    '''비디오 통째로 고칠거면 여기'''
-    if preprocess_type == 'DIFF':
-        raw_video = diff_normalize_video(raw_video)
-        raw_label = diff_normalize_label(raw_label)
-    elif preprocess_type == 'CUSTOM':
-        pass
-
-    return raw_video, raw_label, hrv
-
-
-def get_label(label_path, frame_total):
-    # Load input
-    if label_path.__contains__("hdf5"):
-        f = h5py.File(label_path, 'r')
-        label = np.asarray(f['pulse'])
-
-        # label = decimate(label,int(len(label)/frame_total))
-        label_bvp = bvp.bvp(label, 256, show=False)
-        label = label_bvp['filtered']
-
-        # label = smooth(label, 128)
-        label = resample_poly(label, 15, 128)
-        # label = resample(label,frame_total)
-        # label = detrend(label,100)
-
-        start = label_bvp['onsets'][3]
-        end = label_bvp['onsets'][-2]
-        label = label[start:end]
-        # plt.plot(label)
-        # label = resample(label,frame_total)
-        label -= np.mean(label)
-        label /= np.std(label)
-        start = math.ceil(start / 32)
-        end = math.floor(end / 32)
-    elif label_path.__contains__("json"):
-        name = label_path.split("/")
-        label = []
-        label_time = []
-        label_hr = []
-        time = []
-        with open(label_path[:-4] + name[-2] + ".json") as json_file:
-            json_data = json.load(json_file)
-            for data in json_data['/FullPackage']:
-                label.append(data['Value']['waveform'])
-                label_time.append(data['Timestamp'])
-                label_hr.append(data['Value']['pulseRate'])
-            for data in json_data['/Image']:
-                time.append(data['Timestamp'])
-
-
-    elif label_path.__contains__("csv"):
-        f = open(label_path, 'r')
-        rdr = csv.reader(f)
-        fr = list(rdr)
-        label = np.asarray(fr[1:]).reshape((-1)).astype(np.float32)
-
-        # print("label length" + str(len(label)))
-        f.close()
-
-        f_time = open(label_path[:-8] + "time.txt", 'r')
-        fr_time = f_time.read().split('\n')
-        time = np.asarray(fr_time[:-1]).astype(np.float32)  ## 동영상 시간
-        f_time.close()
-
-        x = np.linspace(time[0], time[-1], len(label))
-        new_x = np.linspace(time[0], time[-1], len(time))
-        f = interp1d(x, label)
-        label = f(new_x)
-
-        f_hr = open(label_path[:-8] + "gt_HR.csv", 'r')
-        rdr = csv.reader(f_hr)
-        fr = list(rdr)
-        label_hr = np.asarray(fr[1:]).reshape((-1)).astype(np.float32)
-        f_hr.close()
-
-        # print("Check")
-    elif label_path.__contains__("label.txt"):
-        cap = cv2.VideoCapture(label_path[:-9] + "video.mkv")
-        frame_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        cap.release()
+def read_frames(cap, frame_total):
+    for _ in range(frame_total):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield frame
 
-        length = int(frame_total / fps * 1000)
 
-        f = open(label_path, 'r')
-        f_read = f.read().split('\n')
-        f.close()
-        label = list(map(float, f_read[:-1]))
-        new_label = label[:length:40]
-        print("A")
-    else:
-        f = open(label_path, 'r')
-        f_read = f.read().split('\n')
-        label = ' '.join(f_read[0].split()).split()
-        label_hr = ' '.join(f_read[1].split()).split()
-        label = list(map(float, label))
-        label = np.array(label).astype('float32')
-        label_hr = list(map(float, label_hr))
-        label_hr = np.array(label_hr).astype('int')
-        f.close()
-
-    label = list(map(float, label))
-    if len(label) != frame_total:
-        label = np.interp(
-            np.linspace(
-                1, len(label), frame_total), np.linspace(
-                1, len(label), len(label)), label)
-
-    return np.array(label, dtype=np.float32)
-
-
-def get_hrv_label(ppg_signal, fs=30.):
-    clean_ppg = detrend(ppg_signal, 100)
-    clean_ppg = BPF(clean_ppg, fs=fs)
-    hrv = get_hrv(clean_ppg, fs=fs)
-    return hrv.astype(np.float32)
-
-
-def diff_normalize_label(label):
-    delta_label = np.diff(label, axis=0)
-    delta_label /= np.std(delta_label)
-    delta_label = np.array(delta_label).astype(np.float32)
-    delta_label = np.append(delta_label, np.zeros(1, dtype=np.float32), axis=0)
-    delta_label[np.isnan(delta_label)] = 0
-    return delta_label
-
-
-def diff_normalize_video(video_data):
-    frame_total, h, w, c = video_data.shape
-
-    raw_video = np.empty((frame_total - 1, h, w, 6), dtype=np.float32)
-    padd = np.zeros((1, h, w, 6), dtype=np.float32)
-    for frame_num in range(frame_total - 1):
-        raw_video[frame_num, :, :, :3] = generate_MotionDifference(video_data[frame_num], video_data[frame_num + 1])
-    raw_video[:, :, :, :3] = raw_video[:, :, :, :3] / np.std(raw_video[:, :, :, :3])
-    raw_video = np.append(raw_video, padd, axis=0)
-    video_data = video_data - np.mean(video_data)
-    raw_video[:, :, :, 3:] = video_data / np.std(video_data)
-    raw_video[:, :, :, 3:] = video_data
-    raw_video[np.isnan(raw_video)] = 0
-    return raw_video
-
-
-def generate_MotionDifference(prev_frame, crop_frame):
-    '''
-    :param prev_frame: previous frame
-    :param crop_frame: current frame
-    :return: motion diff frame
-    '''
-    # motion input
-    motion_input = (crop_frame - prev_frame) / (crop_frame + prev_frame + 0.000000001)
-    # TODO : need to diminish outliers [ clipping ]
-    # motion_input = motion_input / np.std(motion_input)
-    # TODO : do not divide each D frame, modify divide whole video's unit standard deviation
-    return motion_input
+def single_pass_crop(frames, frame_total, detect, videos, large_box_coef, buffer_frames, desc=None):
+    """
+    Decodes every frame once: faces are detected on the frame and cropped as soon as the smoothed box of the frame
+    is known, only frames waiting for their box are buffered (see StreamingBoxTrack).
+
+    :param frames: iterable of decoded BGR frames
+    :param frame_total: max number of frames
+    :param detect: frame -> face location (bottom, right, top, left) as in xy_points of data_preprocess, None if no face
+    :param videos: dict img_size -> VideoStream the cropped RGB frames in [0, 1] are appended to
+    :return: first and last frame index with a detected face
+    """
+    track = StreamingBoxTrack(large_box_coef, buffer_frames)
+
+    def crop(ready):
+        for frame_num, frame, y_x_w in ready:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            append_face(videos, crop_face(frame, y_x_w, None, cv2.INTER_AREA, scale=True))
+
+    for i, frame in enumerate(tqdm(frames, total=frame_total, position=0, leave=True, desc=desc)):
+        crop(track.push(i, frame, detect(frame)))
+    crop(track.flush())
+    if track.front_idx is None:
+        raise ValueError("no face detected in %s" % desc)
+    # frames past the last detection (long trailing gap) are dropped as in the two-pass path
+    for video in videos.values():
+        video.resize(track.rear_idx - track.front_idx + 1)
+    return track.front_idx, track.rear_idx
 
 
 def get_CntYX_Width(xy_points, large_box_coef):
-    y_range_ext = (xy_points.top - xy_points.bottom) * 0.2  # for forehead
-    xy_points.bottom = xy_points.bottom - y_range_ext
+    """
+    :param xy_points: (N, 4) array of face locations (bottom, right, top, left), NaN rows for frames without a face
+    :param large_box_coef: crop size relative to the face height
+    :return: (N, 3) int array of the smoothed box center and half size (cnt_y, cnt_x, bbox_half_size)
+    """
+    bottom, right, top, left = np.asarray(xy_points, dtype=np.float64).T
+    y_range_ext = (top - bottom) * 0.2  # for forehead
+    bottom = bottom - y_range_ext
 
-    xy_points['cnt_y'] = ((xy_points.top + xy_points.bottom) / 2)
-    xy_points['cnt_x'] = ((xy_points.right + xy_points.left) / 2)
-    xy_points['bbox_half_size'] = ((xy_points.top - xy_points.bottom).median() * (large_box_coef / 2))
+    cnt_y = (top + bottom) / 2
+    cnt_x = (right + left) / 2
+    bbox_half_size = np.full(len(cnt_y), np.nanmedian(top - bottom) * (large_box_coef / 2))
     # TODO: dynamic bbox size (ZoomIn ZoomOut)
-    # xy_points['bbox_half_size'] = ((xy_points.top - xy_points.bottom) * (large_box_coef / 2))
+    # bbox_half_size = (top - bottom) * (large_box_coef / 2)
+
+    # linear interpolation of the frames without a face
+    index = np.arange(len(cnt_y))
+    valid = ~np.isnan(cnt_y)
+    cnt_y = np.interp(index, index[valid], cnt_y[valid])
+    cnt_x = np.interp(index, index[valid], cnt_x[valid])
 
-    xy_points = xy_points.interpolate()
+    y_x_w = ewm_mean(np.stack([cnt_y, cnt_x, bbox_half_size], axis=1), alpha=0.1)
+    return np.round(y_x_w).astype(int)
 
-    xy_points.cnt_x = xy_points.cnt_x.ewm(alpha=0.1).mean()
-    xy_points.cnt_y = xy_points.cnt_y.ewm(alpha=0.1).mean()
-    xy_points.bbox_half_size = xy_points.bbox_half_size.ewm(alpha=0.1).mean()
 
-    xy_points = xy_points.round().astype(int)
-    return xy_points[['cnt_y', 'cnt_x', 'bbox_half_size']].values
+def ewm_mean(values, alpha):
+    """
+    Exponentially weighted moving average along the first axis, same as pandas ewm(alpha=alpha, adjust=True).mean()
+
+    :param values: (N, ...) array without NaN
+    :param alpha: smoothing factor
+    """
+    decay = 1. - alpha
+    weighted_sum = lfilter([1.], [1., -decay], values, axis=0)
+    weight = lfilter([1.], [1., -decay], np.ones(len(values)))
+    return weighted_sum / weight.reshape((-1,) + (1,) * (values.ndim - 1))
 
 
 def create_debug_video(raw_video, save_path, video_name, fps=30.):
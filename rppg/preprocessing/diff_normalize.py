@@ -0,0 +1,116 @@
+import numpy as np
+
+
+class RunningStats:
+    """
+        Running mean/variance over blocks of values (Chan et al. parallel form of Welford's algorithm),
+        so the std of a whole video can be computed without a full-size temporary.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        count = block.size
+        if count == 0:
+            return
+        mean = block.mean()
+        m2 = np.square(block - mean).sum()
+        delta = mean - self.mean
+        total = self.count + count
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count) if self.count else 0.
+
+
+def diff_normalize_video(video_data, block_size=256, out=None, standardize_appearance=False):
+    """
+    Two passes over frame blocks: running statistics first, then the normalized blocks are written to out, so the
+    temporaries stay at block_size frames whatever the video length.
+
+    :param video_data: CONT video of shape (T, H, W, C), values in [0, 1]
+    :param block_size: number of frames processed at once, bounds the temporaries
+    :param out: optional preallocated (T, H, W, 2C) array or hdf5 dataset the result is written into
+    :param standardize_appearance: also divide the appearance frames by their std (image_preprocess convention)
+    :return: normalized frame difference in [..., :C] (last frame zero) and mean-centered appearance in [..., C:]
+    """
+    frame_total, h, w, c = video_data.shape
+    if out is None:
+        out = np.empty((frame_total, h, w, 2 * c), dtype=np.float32)
+
+    motion_std, appearance_mean, appearance_std = diff_statistics(video_data, block_size)
+    if not standardize_appearance:
+        appearance_std = np.float32(1.)
+    for start in range(0, frame_total, block_size):
+        end = min(start + block_size, frame_total)
+        out[start:end] = diff_normalize_frames(video_data, start, end, motion_std, appearance_mean, appearance_std)
+    return out
+
+
+def diff_statistics(video_data, block_size=256):
+    """
+    :param video_data: CONT video of shape (T, H, W, C), read block by block
+    :return: std of the frame difference, mean and std of the appearance frames over the whole video
+    """
+    frame_total = video_data.shape[0]
+    motion_stats = RunningStats()
+    appearance_stats = RunningStats()
+    for start in range(0, frame_total, block_size):
+        end = min(start + block_size + 1, frame_total)
+        frames = np.asarray(video_data[start:end], dtype=np.float32)
+        appearance_stats.update(frames[:block_size])
+        if len(frames) < 2:
+            continue
+        motion_stats.update(generate_MotionDifference(frames[:-1], frames[1:]))
+    return np.float32(motion_stats.std), np.float32(appearance_stats.mean), np.float32(appearance_stats.std)
+
+
+def diff_normalize_frames(video_data, start, end, motion_std, appearance_mean, appearance_std=1.):
+    """
+    :param video_data: CONT video of shape (T, H, W, C)
+    :param start: first frame of the block
+    :param end: end frame of the block (exclusive), frame end is read too for the last difference
+    :param motion_std: frame difference std returned by diff_statistics
+    :param appearance_mean: appearance mean returned by diff_statistics
+    :param appearance_std: appearance std returned by diff_statistics, 1 to only mean-center
+    :return: DIFF frames [start, end) of shape (end - start, H, W, 2C), same values as diff_normalize_video
+    """
+    frame_total, h, w, c = video_data.shape
+    frames = np.asarray(video_data[start:min(end + 1, frame_total)], dtype=np.float32)
+    block = np.zeros((end - start, h, w, 2 * c), dtype=np.float32)
+    motion = generate_MotionDifference(frames[:-1], frames[1:])
+    block[:len(motion), :, :, :c] = motion
+    block[..., :c] /= motion_std
+    # the stored DIFF datasets only mean-center the appearance branch (appearance_std=1)
+    block[..., c:] = frames[:end - start] - appearance_mean
+    if appearance_std != 1:
+        block[..., c:] /= appearance_std
+    block[np.isnan(block)] = 0
+    return block
+
+
+def diff_normalize_label(label):
+    delta_label = np.diff(label, axis=0)
+    delta_label /= np.std(delta_label)
+    delta_label = np.array(delta_label).astype(np.float32)
+    delta_label = np.append(delta_label, np.zeros(1, dtype=np.float32), axis=0)
+    delta_label[np.isnan(delta_label)] = 0
+    return delta_label
+
+
+def generate_MotionDifference(prev_frame, crop_frame):
+    '''
+    :param prev_frame: previous frame(s)
+    :param crop_frame: current frame(s)
+    :return: motion diff frame(s)
+    '''
+    # motion input
+    motion_input = (crop_frame - prev_frame) / (crop_frame + prev_frame + 0.000000001)
+    return motion_input
@@ -0,0 +1,294 @@
+import time
+
+import cv2
+import numpy as np
+
+from rppg.log import log_warning
+
+try:
+    import mediapipe as mp
+except ImportError:
+    mp = None
+
+FACE_DETECTORS = {}
+
+
+def register_face_detector(name):
+    """
+    Class decorator adding a FaceDetector to the registry under name (preprocess.common.face_detect_algorithm).
+    """
+
+    def register(cls):
+        cls.name = name
+        FACE_DETECTORS[name] = cls
+        return cls
+
+    return register
+
+
+def face_detector_name(algorithm):
+    """
+    :param algorithm: registered name ('hog', 'cnn', 'haar', 'mediapipe') or a legacy numeric code, which always
+                      meant hog since preprocessing ignored it
+    :return: registered name of the detector
+    """
+    if isinstance(algorithm, int):
+        if algorithm != 1:
+            log_warning("face_detect_algorithm %d is a legacy code, using hog as before; choose another detector by "
+                        "name (%s)" % (algorithm, ', '.join(sorted(FACE_DETECTORS))))
+        return 'hog'
+    name = algorithm
+    if name not in FACE_DETECTORS:
+        raise ValueError("unknown face_detect_algorithm: %s, choose from %s" % (algorithm, sorted(FACE_DETECTORS)))
+    return name
+
+
+def get_face_detector(algorithm, **kwargs):
+    """
+    :param algorithm: registered name or legacy code, see face_detector_name
+    :param kwargs: detector arguments, e.g. scale
+    :return: FaceDetector instance
+    """
+    return FACE_DETECTORS[face_detector_name(algorithm)](**kwargs)
+
+
+class FaceDetector:
+    """
+        Batch face detector: detect() takes a list of BGR frames and returns one (box, confidence) per frame,
+        the most confident face with box = (top, right, bottom, left) in full-resolution pixels as returned by
+        face_recognition, (None, 0.) without a face.
+
+        Frames are resized by scale before detection and boxes mapped back (preprocess.common.detect_scale).
+        Backends implement _detect on the resized batch; batch_size is the number of frames a backend can
+        process at once, 1 for per-frame detectors.
+    """
+    name = None
+    batch_size = 1
+
+    def __init__(self, scale=1.):
+        self.scale = scale
+
+    @property
+    def settings(self):
+        """
+        :return: parameters the boxes depend on, used to validate cached detections
+        """
+        return dict(model=self.name, detect_scale=self.scale)
+
+    def _detect(self, frames):
+        raise NotImplementedError
+
+    def detect(self, frames):
+        """
+        :param frames: list of BGR frames of the same size
+        :return: list of (box, confidence) per frame
+        """
+        if self.scale != 1:
+            frames = [cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+                      for frame in frames]
+        results = []
+        for start in range(0, len(frames), self.batch_size):
+            results += self._detect(frames[start:start + self.batch_size])
+        if self.scale == 1:
+            return results
+        return [(None if box is None else tuple(int(round(v / self.scale)) for v in box), confidence)
+                for box, confidence in results]
+
+    def __call__(self, frame):
+        """
+        :return: box of the most confident face in frame or None, the per-frame detector of data_preprocess
+        """
+        return self.detect([frame])[0][0]
+
+
+def _best_box(boxes, confidences):
+    if len(boxes) == 0:
+        return None, 0.
+    best = int(np.argmax(confidences))
+    return tuple(int(v) for v in boxes[best]), float(confidences[best])
+
+
+def _trim_box(top, right, bottom, left, shape):
+    return max(top, 0), min(right, shape[1]), min(bottom, shape[0]), max(left, 0)
+
+
+@register_face_detector('hog')
+class HOGFaceDetector(FaceDetector):
+    """
+        dlib HOG detector used by face_recognition.face_locations, boxes are identical to it.
+    """
+
+    def __init__(self, scale=1., upsample=1):
+        super().__init__(scale)
+        import face_recognition.api as face_api
+        self.detector = face_api.face_detector
+        self.upsample = upsample
+
+    @property
+    def settings(self):
+        return dict(super().settings, upsample=self.upsample)
+
+    def _detect(self, frames):
+        results = []
+        for frame in frames:
+            rects, scores, _ = self.detector.run(frame, self.upsample, 0.)
+            boxes = [_trim_box(rect.top(), rect.right(), rect.bottom(), rect.left(), frame.shape) for rect in rects]
+            results.append(_best_box(boxes, scores))
+        return results
+
+
+@register_face_detector('cnn')
+class CNNFaceDetector(FaceDetector):
+    """
+        dlib CNN (MMOD) detector of face_recognition, runs batch_size frames per call (GPU if dlib has CUDA).
+    """
+
+    def __init__(self, scale=1., upsample=1, batch_size=16):
+        super().__init__(scale)
+        import face_recognition.api as face_api
+        self.detector = face_api.cnn_face_detector
+        self.upsample = upsample
+        self.batch_size = batch_size
+
+    @property
+    def settings(self):
+        return dict(super().settings, upsample=self.upsample)
+
+    def _detect(self, frames):
+        results = []
+        for frame, detections in zip(frames, self.detector(frames, self.upsample, batch_size=len(frames))):
+            boxes = [_trim_box(d.rect.top(), d.rect.right(), d.rect.bottom(), d.rect.left(), frame.shape)
+                     for d in detections]
+            results.append(_best_box(boxes, [d.confidence for d in detections]))
+        return results
+
+
+@register_face_detector('haar')
+class HaarFaceDetector(FaceDetector):
+    """
+        OpenCV Haar cascade (haarcascade_frontalface_alt2, scaleFactor 1.3, minNeighbors 5) as in image_preprocess,
+        the confidence is the level weight of the cascade.
+    """
+
+    def __init__(self, scale=1., scale_factor=1.3, min_neighbors=5):
+        super().__init__(scale)
+        if not hasattr(cv2, 'CascadeClassifier'):
+            raise ImportError("this OpenCV build has no CascadeClassifier, install opencv 4.x for the haar detector")
+        self.detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_alt2.xml")
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    @property
+    def settings(self):
+        return dict(super().settings, scale_factor=self.scale_factor, min_neighbors=self.min_neighbors)
+
+    def _detect(self, frames):
+        results = []
+        for frame in frames:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+            rects, _, weights = self.detector.detectMultiScale3(gray, self.scale_factor, self.min_neighbors,
+                                                                 outputRejectLevels=True)
+            boxes = [(y, x + w, y + h, x) for x, y, w, h in rects]
+            results.append(_best_box(boxes, np.ravel(weights)))
+        return results
+
+
+@register_face_detector('mediapipe')
+class MediaPipeFaceDetector(FaceDetector):
+    """
+        MediaPipe face detection (BlazeFace) of the solutions API, needs the optional mediapipe package.
+    """
+
+    def __init__(self, scale=1., model_selection=1, min_confidence=0.5):
+        super().__init__(scale)
+        if mp is None or not hasattr(mp, 'solutions'):
+            raise ImportError("the mediapipe detector needs mediapipe with the solutions API (mediapipe<=0.10)")
+        self.detector = mp.solutions.face_detection.FaceDetection(model_selection=model_selection,
+                                                                  min_detection_confidence=min_confidence)
+        self.model_selection = model_selection
+        self.min_confidence = min_confidence
+
+    @property
+    def settings(self):
+        return dict(super().settings, model_selection=self.model_selection, min_confidence=self.min_confidence)
+
+    def _detect(self, frames):
+        results = []
+        for frame in frames:
+            height, width = frame.shape[:2]
+            detections = self.detector.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).detections or []
+            boxes = []
+            for detection in detections:
+                box = detection.location_data.relative_bounding_box
+                top, left = int(box.ymin * height), int(box.xmin * width)
+                boxes.append(_trim_box(top, left + int(box.width * width), top + int(box.height * height), left,
+                                       frame.shape))
+            results.append(_best_box(boxes, [detection.score[0] for detection in detections]))
+        return results
+
+
+def frame_batches(frames, batch_size):
+    """
+    :param frames: iterable of frames
+    :return: generator of lists of up to batch_size consecutive frames
+    """
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def box_iou(a, b):
+    """
+    :param a: box (top, right, bottom, left)
+    :param b: box (top, right, bottom, left)
+    :return: intersection over union of the two boxes
+    """
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    area = lambda box: (box[2] - box[0]) * (box[1] - box[3])
+    return inter / float(area(a) + area(b) - inter)
+
+
+def benchmark_face_detectors(frames, algorithms, reference='hog', scale=1., reference_scale=None):
+    """
+    Runs every detector on the same frames and compares its boxes with the reference detector.
+
+    :param frames: list of BGR frames of a sample clip
+    :param algorithms: registered detector names to compare
+    :param reference: detector whose boxes are taken as ground truth
+    :param scale: detect_scale of the compared detectors
+    :param reference_scale: detect_scale of the reference, None for scale
+    :return: dict name -> dict(fps, detected (ratio of frames with a face), iou and center_error (px) against the
+             reference on frames where both found a face), detectors that can't be created are skipped
+    """
+
+    def run(name, detect_scale):
+        try:
+            detector = get_face_detector(name, scale=detect_scale)
+        except ImportError as e:
+            log_warning("skipping %s: %s" % (name, e))
+            return None, None
+        start = time.time()
+        boxes = [box for box, _ in detector.detect(frames)]
+        return boxes, len(frames) / (time.time() - start)
+
+    reference_scale = scale if reference_scale is None else reference_scale
+    reference_boxes, _ = run(reference, reference_scale)
+    report = {}
+    for name in algorithms:
+        boxes, fps = run(name, scale)
+        if boxes is None:
+            continue
+        pairs = [(a, b) for a, b in zip(reference_boxes or [], boxes) if a is not None and b is not None]
+        report[name] = dict(
+            fps=fps, detected=float(np.mean([box is not None for box in boxes])),
+            iou=float(np.mean([box_iou(a, b) for a, b in pairs])) if pairs else 0.,
+            center_error=float(np.mean([np.hypot((a[0] + a[2] - b[0] - b[2]) / 2, (a[1] + a[3] - b[1] - b[3]) / 2)
+                                        for a, b in pairs])) if pairs else 0.)
+    return report
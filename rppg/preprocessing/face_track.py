@@ -0,0 +1,272 @@
+import json
+import os
+from collections import deque
+
+import cv2
+import numpy as np
+
+# sidecar directory of FaceTrackCache files, next to the CONT/DIFF directories of a preprocessed dataset
+FACE_TRACK_DIR = 'FACE_TRACK'
+
+
+class StreamingBoxTrack:
+    """
+        Online version of get_CntYX_Width for single-pass preprocessing.
+
+        Detections are pushed frame by frame and the smoothed (cnt_y, cnt_x, bbox_half_size) of a frame is emitted
+        as soon as it is known: gaps between detections are interpolated linearly once the next detection arrives
+        and the centers go through the same alpha=0.1 exponential moving average as get_CntYX_Width.
+        Frames before the first and after the last detection are dropped, as in the two-pass path.
+
+        Two things differ from get_CntYX_Width so memory stays bounded:
+        the box size is the median over the first buffer_frames frames instead of the whole video, and a gap
+        longer than buffer_frames is filled with the last detected center instead of being interpolated.
+    """
+
+    def __init__(self, large_box_coef, buffer_frames=300, alpha=0.1):
+        """
+        :param large_box_coef: crop size relative to the detected face height
+        :param buffer_frames: max number of frames held back (box size warm-up, detection gaps)
+        :param alpha: smoothing factor of the center moving average
+        """
+        self.large_box_coef = large_box_coef
+        self.buffer_frames = max(1, buffer_frames)
+        self.alpha = alpha
+
+        self.bbox_half_size = None
+        self.warmup = []  # (frame index, item, (cnt_y, cnt_x, height) or None) until the box size is known
+        self.pending = deque()  # (frame index, item) after the last detection
+        self.last_center = None
+        self.ewm = None  # (weight, cnt_y, cnt_x, bbox_half_size), same recursion as pandas ewm(adjust=True)
+        self.front_idx = None
+        self.rear_idx = None
+
+    def push(self, frame_idx, item, box):
+        """
+        :param frame_idx: index of the frame in the source video
+        :param item: frame (or anything) handed back with its box
+        :param box: (bottom, right, top, left) as stored by data_preprocess, None if no face was detected
+        :return: list of (frame index, item, (cnt_y, cnt_x, bbox_half_size)) ready to be cropped
+        """
+        if box is not None:
+            bottom, right, top, left = box
+            y_range_ext = (top - bottom) * 0.2  # for forehead
+            bottom = bottom - y_range_ext
+            detection = ((top + bottom) / 2, (right + left) / 2, top - bottom)
+            if self.front_idx is None:
+                self.front_idx = frame_idx
+            self.rear_idx = frame_idx
+        elif self.front_idx is None:
+            return []
+        else:
+            detection = None
+
+        if self.bbox_half_size is None:
+            self.warmup.append((frame_idx, item, detection))
+            if len(self.warmup) < self.buffer_frames:
+                return []
+            return self._end_warmup()
+        return self._push(frame_idx, item, detection)
+
+    def flush(self):
+        """
+        :return: remaining frames up to the last detection, frames after it are dropped
+        """
+        ready = self._end_warmup() if self.bbox_half_size is None else []
+        self.pending.clear()
+        return ready
+
+    def _end_warmup(self):
+        heights = [detection[2] for _, _, detection in self.warmup if detection is not None]
+        if len(heights) == 0:
+            return []
+        self.bbox_half_size = np.median(heights) * (self.large_box_coef / 2)
+        ready = []
+        for frame_idx, item, detection in self.warmup:
+            ready += self._push(frame_idx, item, detection)
+        self.warmup = []
+        return ready
+
+    def _push(self, frame_idx, item, detection):
+        if detection is None:
+            self.pending.append((frame_idx, item))
+            if len(self.pending) < self.buffer_frames:
+                return []
+            # gap too long to wait for the next detection, hold the last center
+            return [self._smooth(idx, pending_item, self.last_center) for idx, pending_item in self._pop_pending()]
+
+        center = detection[:2]
+        ready = []
+        gap = len(self.pending) + 1
+        for k, (idx, pending_item) in enumerate(self._pop_pending(), start=1):
+            ready.append(self._smooth(idx, pending_item, tuple(
+                prev + (cur - prev) * k / gap for prev, cur in zip(self.last_center, center))))
+        self.last_center = center
+        ready.append(self._smooth(frame_idx, item, center))
+        return ready
+
+    def _pop_pending(self):
+        while self.pending:
+            yield self.pending.popleft()
+
+    def _smooth(self, frame_idx, item, center):
+        values = (center[0], center[1], self.bbox_half_size)
+        if self.ewm is None:
+            self.ewm = (1.,) + values
+        else:
+            old_weight = self.ewm[0] * (1. - self.alpha)
+            self.ewm = (old_weight + 1.,) + tuple(
+                (old_weight * avg + value) / (old_weight + 1.) for avg, value in zip(self.ewm[1:], values))
+        return frame_idx, item, tuple(int(v) for v in np.round(self.ewm[1:]))
+
+
+class SparseDetector:
+    """
+        Runs a face detector on keyframes only. Frames in between return None and are filled by the gap
+        interpolation of get_CntYX_Width / StreamingBoxTrack, which is smoothed by the same moving average anyway.
+
+        A frame is a keyframe every `stride` frames, right after a keyframe without a face, on the last frame
+        (so trailing frames are not dropped) and, with a motion threshold, when the mean absolute difference of a
+        small grayscale thumbnail to the last keyframe exceeds it.
+    """
+
+    def __init__(self, detect, stride=1, motion_threshold=0., frame_total=None):
+        """
+        :param detect: frame -> face location or None
+        :param stride: number of frames between two detections, 1 detects on every frame
+        :param motion_threshold: mean absolute thumbnail difference (0-255) forcing a detection, 0 to disable
+        :param frame_total: number of frames of the video, the last one is always detected
+        """
+        self.detect = detect
+        self.stride = max(1, stride)
+        self.motion_threshold = motion_threshold
+        self.frame_total = frame_total
+        self.frame_idx = -1
+        self.last_keyframe = None
+        self.last_thumbnail = None
+        self.calls = 0
+
+    def _thumbnail(self, frame):
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(frame, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def __call__(self, frame):
+        self.frame_idx += 1
+        thumbnail = self._thumbnail(frame) if self.motion_threshold > 0 else None
+
+        keyframe = (self.last_keyframe is None
+                    or self.frame_idx - self.last_keyframe >= self.stride
+                    or self.frame_idx == (self.frame_total or 0) - 1)
+        if not keyframe and thumbnail is not None:
+            keyframe = np.abs(thumbnail - self.last_thumbnail).mean() > self.motion_threshold
+        if not keyframe:
+            return None
+
+        self.calls += 1
+        box = self.detect(frame)
+        # a keyframe without a face is retried on the next frame
+        self.last_keyframe = self.frame_idx if box is not None else None
+        self.last_thumbnail = thumbnail
+        return box
+
+
+def crop_face(frame, y_x_w, img_size, interpolation, scale=False):
+    """
+    :param frame: decoded frame (H, W, C)
+    :param y_x_w: (cnt_y, cnt_x, bbox_half_size) of the frame
+    :param img_size: output image size, None to keep the box resolution
+    :param interpolation: cv2 interpolation flag
+    :param scale: True to map uint8 pixels to float32 [0, 1] before resizing
+    :return: face crop (img_size, img_size, C), border pixels are repeated where the box leaves the frame
+    """
+    face = np.take(frame, range(y_x_w[0] - y_x_w[2], y_x_w[0] + y_x_w[2]), 0, mode='clip')
+    face = np.take(face, range(y_x_w[1] - y_x_w[2], y_x_w[1] + y_x_w[2]), 1, mode='clip')
+    if scale:
+        face = (face / 255.).astype(np.float32)
+    if img_size is None or img_size == y_x_w[2] * 2:
+        return face
+    return cv2.resize(face, (img_size, img_size), interpolation=interpolation)
+
+
+class FaceTrackCache:
+    """
+        Sidecar .npz file of the raw per-frame face boxes of one source video, shared by every crop setting.
+
+        Detection only depends on the source and the detector settings, so a rerun with another image_size,
+        larger_box_coef or preprocessing type loads the boxes instead of detecting again and only decodes, crops
+        and resizes. The cache is stale when the size/mtime of the source or the detector settings change.
+    """
+
+    def __init__(self, path, source_path, settings):
+        """
+        :param path: sidecar file path (.npz)
+        :param source_path: source video file or frame directory
+        :param settings: detector settings the boxes depend on (model, scale, stride, ...)
+        """
+        self.path = path
+        self.settings = settings
+        stat = os.stat(source_path)
+        size = len(os.listdir(source_path)) if os.path.isdir(source_path) else stat.st_size
+        self.source = [source_path, size, stat.st_mtime_ns]
+
+    def load(self):
+        """
+        :return: (boxes, fps) stored for the same source and settings, None if missing or stale
+        """
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            with np.load(self.path) as data:
+                meta = json.loads(str(data['meta']))
+                if meta['source'] != self.source or meta['settings'] != self.settings:
+                    return None
+                return data['boxes'], float(data['fps'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, boxes, fps):
+        """
+        :param boxes: (frame_total, 4) face locations (bottom, right, top, left), NaN rows for frames without a face
+        :param fps: frame rate of the source
+        """
+        valid = np.flatnonzero(~np.isnan(boxes[:, 2]))
+        meta = dict(source=self.source, settings=self.settings)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = '%s.tmp%d' % (self.path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, boxes=boxes, fps=fps, frame_total=len(boxes),
+                     valid_range=valid[[0, -1]] if len(valid) else np.array([-1, -1]), meta=json.dumps(meta))
+        os.replace(tmp_path, self.path)
+
+
+def replay_detector(boxes):
+    """
+    :param boxes: (frame_total, 4) boxes loaded from a FaceTrackCache
+    :return: frame -> cached face location of the next frame or None, a drop-in for the detector
+    """
+    boxes = iter(boxes)
+
+    def detect(frame):
+        box = next(boxes)
+        return None if np.isnan(box[2]) else tuple(box)
+
+    return detect
+
+
+def recording_detector(detect, boxes):
+    """
+    :param detect: frame -> face location or None
+    :param boxes: (frame_total, 4) NaN array, the result of every call is stored in the next row
+    :return: detector recording its results into boxes
+    """
+    frame_idx = iter(range(len(boxes)))
+
+    def record(frame):
+        box = detect(frame)
+        i = next(frame_idx)
+        if box is not None:
+            boxes[i] = box
+        return box
+
+    return record
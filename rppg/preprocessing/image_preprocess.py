@@ -15,6 +15,21 @@ from skimage.util import img_as_float
 from sklearn import preprocessing
 from tqdm import tqdm
 
+from rppg.preprocessing.diff_normalize import diff_normalize_video
+from rppg.preprocessing.face_detectors import get_face_detector
+
+_hog_detector = None
+
+
+def hog_detector():
+    '''
+    :return: hog FaceDetector shared by the per-frame helpers, built on first use
+    '''
+    global _hog_detector
+    if _hog_detector is None:
+        _hog_detector = get_face_detector('hog')
+    return _hog_detector
+
 
 def video_preprocess(preprocess_type, path, **kwargs):
     video_data = CONT_preprocess_Video(path, **kwargs)
@@ -33,21 +48,8 @@ def DIFF_preprocess_Video(path, video_data, **kwargs):
     :return: [:,:,:0-2] : motion diff frame
              [:,:,:,3-5] : normalized frame
     '''
-    frame_total, h, w, c = video_data.shape
-
-    raw_video = np.empty((frame_total - 1, h, w, 6))
-    padd = np.zeros((1, h, w, 6), dtype=np.float32)
-    with tqdm(total=frame_total, position=0, leave=True, desc=path) as pbar:
-        for frame_num in range(frame_total - 1):
-            # raw_video[frame_num, :, :, :3], raw_video[frame_num, :, :, -3:] = preprocess_Image(video_data[frame_num],video_data[frame_num + 1])
-            raw_video[frame_num, :, :, :3] = generate_MotionDifference(video_data[frame_num], video_data[frame_num + 1])
-            pbar.update(1)
-        raw_video[:, :, :, :3] = raw_video[:, :, :, :3] / np.std(raw_video[:, :, :, :3])
-        raw_video = np.append(raw_video, padd, axis=0)
-        video_data = video_data - np.mean(video_data)
-        raw_video[:, :, :, 3:] = video_data / np.std(video_data)
-        raw_video[np.isnan(raw_video)] = 0
-    return raw_video
+    # motion diff / std and (frame - mean) / std, computed block-wise into one preallocated output
+    return diff_normalize_video(video_data, standardize_appearance=True)
 
 
 def CONT_preprocess_Video(path, **kwargs):
@@ -60,6 +62,8 @@ def CONT_preprocess_Video(path, **kwargs):
 
     img_size = kwargs['img_size']
     flip_flag = kwargs['flip_flag']  # 0,1,2,3
+    detect_scale = kwargs.get('detect_scale', 1.)  # face detection on a downscaled frame, boxes mapped back
+    detector = get_face_detector(kwargs.get('face_detect_algorithm', 'hog'), scale=detect_scale)
     if flip_flag == None:
         flip_flag = 0
     pos = []
@@ -77,10 +81,8 @@ def CONT_preprocess_Video(path, **kwargs):
                 height, width, c = frame.shape
                 if height <= width:
                     frame = frame[:, round((width - height) / 2):round((width - height) / 2) + height]
-                face_locations = face_recognition.face_locations(frame, 1)
-                if len(face_locations) >= 1:
-                    face_locations = list(face_locations)
-                    face_location = face_locations[0]
+                face_location = detector(frame)
+                if face_location is not None:
                     pos.append(
                         {
                             'success': True,
@@ -168,10 +170,8 @@ def CONT_preprocess_Video(path, **kwargs):
         with tqdm(total=frame_total, position=0, leave=True, desc=path) as pbar:
             while j < frame_total:
                 frame = frames[j]
-                face_locations = face_recognition.face_locations((frame * 255.).astype(np.uint8), 1)
-                if len(face_locations) >= 1:
-                    face_locations = list(face_locations)
-                    face_location = face_locations[0]
+                face_location = detector((frame * 255.).astype(np.uint8))
+                if face_location is not None:
                     pos.append(
                         {
                             'success': True,
@@ -278,10 +278,8 @@ def CONT_preprocess_Video(path, **kwargs):
                 if ret:
                     if crop_before_detect:
                         frame = frame[:, round((width - height) / 2):round((width - height) / 2) + height]
-                    face_locations = face_recognition.face_locations(frame, 1)
-                    if len(face_locations) >= 1:
-                        face_locations = list(face_locations)
-                        face_location = face_locations[0]
+                    face_location = detector(frame)
+                    if face_location is not None:
                         pos.append(
                             {
                                 'success': True,
@@ -636,10 +634,10 @@ def faceDetection(frame):
     :return: cropped face image
     '''
     resized_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-    face_location = face_locations(resized_frame)
-    if len(face_location) == 0:  # can't detect face
+    face_location = hog_detector()(resized_frame)
+    if face_location is None:  # can't detect face
         return False, None
-    top, right, bottom, left = face_location[0]
+    top, right, bottom, left = face_location
     dst = resized_frame[top:bottom, left:right]
     return True, dst
     # return True, [top, right, bottom, left]
@@ -0,0 +1,178 @@
+import json
+import math
+import os
+
+import h5py
+import numpy as np
+from scipy.signal import resample_poly
+
+from rppg.preprocessing.manifest import PreprocessManifest
+from rppg.utils.funcs import detrend, BPF, get_hrv
+
+try:
+    from biosppy.signals import bvp
+except ImportError:
+    bvp = None
+
+# sidecar directory of LabelCache files, next to the CONT/DIFF directories of a preprocessed dataset
+LABEL_DIR = 'LABEL'
+
+
+class LabelCache:
+    """
+        Sidecar .npz file of the labels of one source video: the parsed ground truth (ppg, and timestamps / hr where
+        the format has them) and the labels derived from it (ppg resampled to the video, hrv), so re-preprocessing
+        neither re-parses nor re-derives unchanged labels. The cache is stale when the size/mtime of a label file
+        changes.
+    """
+
+    def __init__(self, path, sources):
+        """
+        :param path: sidecar file path (.npz), None to keep the labels in memory only
+        :param sources: files the labels are parsed from
+        """
+        self.path = path
+        self.source = PreprocessManifest.source_stat(sources)
+        self.arrays = {}
+        self.changed = False
+        if path is None or not os.path.isfile(path):
+            return
+        try:
+            with np.load(path) as data:
+                if json.loads(str(data['source'])) == self.source:
+                    self.arrays = {name: data[name] for name in data.files if name != 'source'}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def update(self, arrays):
+        self.arrays.update({name: np.asarray(value) for name, value in arrays.items()})
+        self.changed = True
+
+    def get(self, name, compute):
+        """
+        :param compute: () -> array, called if name is not cached
+        """
+        if name not in self.arrays:
+            self.update({name: compute()})
+        return self.arrays[name]
+
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = '%s.tmp%d' % (self.path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, source=json.dumps(self.source), **self.arrays)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+
+def label_sources(label_path):
+    """
+    :return: files parse_label reads for label_path
+    """
+    if label_path.__contains__("json"):
+        return [label_path[:-4] + label_path.split("/")[-2] + ".json"]
+    if label_path.__contains__("csv"):
+        return [label_path, label_path[:-8] + "time.txt", label_path[:-8] + "gt_HR.csv"]
+    return [label_path]
+
+
+def _read_lines(path):
+    with open(path) as f:
+        return f.read().split('\n')
+
+
+def parse_label(label_path):
+    """
+    Parses the ground truth of one source video, in one vectorized conversion per column.
+
+    :return: dict with 'ppg' (the pulse wave at its own sampling, resampled to the video by resample_label) and the
+             'timestamps' / 'hr' columns where the format has them
+    """
+    # COHFACE
+    if label_path.__contains__("hdf5"):
+        if bvp is None:
+            raise ImportError("biosppy is needed to filter the hdf5 (COHFACE) pulse labels")
+        with h5py.File(label_path, 'r') as f:
+            pulse = np.asarray(f['pulse'])
+        label_bvp = bvp.bvp(pulse, 256, show=False)
+        ppg = resample_poly(label_bvp['filtered'], 15, 128)
+        start = label_bvp['onsets'][3]
+        end = label_bvp['onsets'][-2]
+        ppg = ppg[start:end]
+        ppg -= np.mean(ppg)
+        ppg /= np.std(ppg)
+        return dict(ppg=ppg, onsets=np.array([math.ceil(start / 32), math.floor(end / 32)]))
+
+    # PURE
+    if label_path.__contains__("json"):
+        with open(label_sources(label_path)[0]) as json_file:
+            json_data = json.load(json_file)
+        packages = json_data['/FullPackage']
+        return dict(ppg=np.array([data['Value']['waveform'] for data in packages], dtype=np.float64),
+                    hr=np.array([data['Value']['pulseRate'] for data in packages], dtype=np.float32),
+                    timestamps=np.array([data['Timestamp'] for data in packages], dtype=np.int64),
+                    frame_timestamps=np.array([data['Timestamp'] for data in json_data['/Image']], dtype=np.int64))
+
+    # VIPL_HR, the wave is mapped to the video timestamps
+    if label_path.__contains__("csv"):
+        _, time_path, hr_path = label_sources(label_path)
+        wave = np.loadtxt(label_path, delimiter=',', skiprows=1, dtype=np.float32, ndmin=1).reshape(-1)
+        timestamps = np.asarray(_read_lines(time_path)[:-1]).astype(np.float32)  # video time
+        x = np.linspace(timestamps[0], timestamps[-1], len(wave))
+        new_x = np.linspace(timestamps[0], timestamps[-1], len(timestamps))
+        return dict(ppg=np.interp(new_x, x, wave), timestamps=timestamps,
+                    hr=np.loadtxt(hr_path, delimiter=',', skiprows=1, dtype=np.float32, ndmin=1).reshape(-1))
+
+    # V4V
+    if label_path.__contains__("label.txt"):
+        return dict(ppg=np.asarray(_read_lines(label_path)[:-1]).astype(np.float64))
+
+    # UBFC: pulse wave, hr and timestamps, one row each
+    rows = _read_lines(label_path)
+    parsed = dict(ppg=np.asarray(rows[0].split()).astype(np.float32),
+                  hr=np.asarray(rows[1].split()).astype(np.float32))
+    if len(rows) > 2 and rows[2].split():
+        parsed['timestamps'] = np.asarray(rows[2].split()).astype(np.float64)
+    return parsed
+
+
+def resample_label(ppg, frame_total):
+    """
+    :return: ppg linearly resampled to frame_total frames, float32
+    """
+    ppg = np.asarray(ppg, dtype=np.float64)
+    if len(ppg) != frame_total:
+        ppg = np.interp(np.linspace(1, len(ppg), frame_total), np.linspace(1, len(ppg), len(ppg)), ppg)
+    return ppg.astype(np.float32)
+
+
+def get_hrv_label(ppg_signal, fs=30.):
+    clean_ppg = detrend(ppg_signal, 100)
+    clean_ppg = BPF(clean_ppg, fs=fs)
+    hrv = get_hrv(clean_ppg, fs=fs)
+    return hrv.astype(np.float32)
+
+
+def read_label(label_path, frame_total, fs=30., cache_path=None):
+    """
+    :param label_path: ground truth path of a source video
+    :param frame_total: number of frames of the video
+    :param fs: video frame rate
+    :param cache_path: LabelCache sidecar of the source, None to always parse
+    :return: label resampled to frame_total frames and its hrv
+    """
+    labels = LabelCache(cache_path, label_sources(label_path))
+    if 'ppg' not in labels:
+        labels.update(parse_label(label_path))
+    label = labels.get('label_%d' % frame_total, lambda: resample_label(labels['ppg'], frame_total))
+    hrv = labels.get('hrv_%d_%g' % (frame_total, fs), lambda: get_hrv_label(label, fs=fs))
+    labels.save()
+    return label, hrv
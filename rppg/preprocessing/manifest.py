@@ -0,0 +1,107 @@
+import json
+import os
+import time
+
+import h5py
+
+MANIFEST_NAME = 'manifest.json'
+
+
+class PreprocessManifest:
+    """
+        Per-file record of a preprocessed dataset directory ({dataset_path}/{dataset}/{type}/manifest.json).
+
+        Every source video is stored with the size/mtime of its input files, the preprocessing parameters and the
+        output status, so a rerun only processes files that are missing, stale (changed input or parameters) or
+        failed. The file is rewritten atomically after every update, an interrupted run resumes where it stopped.
+        With a lock (FileClaims) the manifest is shared by several processes: every save merges the entries updated
+        here into the file on disk.
+    """
+
+    def __init__(self, path, lock=None):
+        """
+        :param path: manifest.json path
+        :param lock: FileClaims of the processes sharing the directory, None if this process is the only writer
+        """
+        self.path = path
+        self.lock = lock
+        self.entries = {}
+        self.updated = set()
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def source_stat(paths):
+        """
+        :param paths: input files (or frame directories) of one source video
+        :return: [path, size, mtime_ns] of every input, a directory counts its entries as size, a missing input is
+                 [path, None, None] so its appearance also makes the entry stale
+        """
+        stats = []
+        for path in paths:
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                stats.append([path, stat.st_size, stat.st_mtime_ns])
+            elif os.path.isdir(path):
+                stats.append([path, len(os.listdir(path)), os.stat(path).st_mtime_ns])
+            else:
+                stats.append([path, None, None])
+        return stats
+
+    @staticmethod
+    def is_complete(output_path):
+        """
+        :return: True if output_path is a readable preprocessed file whose videos, preprocessed_label and hrv have
+                 the same length, not a file truncated by an interrupted run
+        """
+        try:
+            with h5py.File(output_path, 'r') as f:
+                videos = [name for name in f if name == 'raw_video' or name.startswith('raw_video_')]
+                if not videos or 'preprocessed_label' not in f or 'hrv' not in f:
+                    return False
+                length = len(f['preprocessed_label'])
+                return all(len(f[name]) == length for name in videos + ['hrv'])
+        except (OSError, KeyError, TypeError):
+            return False
+
+    def is_current(self, data_path, source, params, output_path):
+        """
+        :return: True if data_path was preprocessed successfully from the same inputs with the same parameters
+        """
+        entry = self.entries.get(data_path)
+        if entry is None and os.path.isfile(output_path) and self.is_complete(output_path):
+            # output written before the manifest existed, adopted once it is checked to be complete (recorded on the
+            # next save); older versions wrote in place, so a crashed run can leave a truncated file behind
+            self.entries[data_path] = dict(source=source, params=params, output=output_path, status='done',
+                                           error=None, time=time.strftime('%Y-%m-%d %H:%M:%S'))
+            self.updated.add(data_path)
+            return True
+        return (entry is not None and entry['status'] == 'done' and entry['source'] == source
+                and entry['params'] == params and os.path.isfile(output_path))
+
+    def update(self, data_path, source, params, output_path, status, error=None):
+        self.entries[data_path] = dict(source=source, params=params, output=output_path, status=status,
+                                       error=error, time=time.strftime('%Y-%m-%d %H:%M:%S'))
+        self.updated.add(data_path)
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.lock is None:
+            self._write()
+            return
+        with self.lock.hold(MANIFEST_NAME):
+            # entries written by the other processes are kept, only the ones updated here are replaced
+            if os.path.isfile(self.path):
+                with open(self.path) as f:
+                    entries = json.load(f)
+                entries.update({data_path: self.entries[data_path] for data_path in self.updated})
+                self.entries = entries
+            self._write()
+
+    def _write(self):
+        tmp_path = self.path + '.tmp%d' % os.getpid()
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.path)
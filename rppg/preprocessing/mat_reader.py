@@ -0,0 +1,193 @@
+import os
+import struct
+import tempfile
+
+import h5py
+import numpy as np
+import scipy.io as sio
+
+from rppg.log import log_warning
+
+# MAT v5 data element types
+MI_MATRIX = 14
+MI_DTYPES = {1: 'i1', 2: 'u1', 3: 'i2', 4: 'u2', 5: 'i4', 6: 'u4', 7: 'f4', 9: 'f8', 12: 'i8', 13: 'u8'}
+# array flags bit of complex arrays
+MAT_COMPLEX = 0x0800
+
+
+def _v5_element_tag(f, byte_order):
+    """
+    :return: (data type, number of bytes, small element data or None) of the element tag at the file position
+    """
+    tag = f.read(8)
+    if len(tag) < 8:
+        return None, 0, None
+    mdtype, byte_count = struct.unpack(byte_order + 'II', tag)
+    if mdtype >> 16:
+        # small data element format, the data sits in the last 4 bytes of the tag
+        return mdtype & 0xffff, mdtype >> 16, tag[4:4 + (mdtype >> 16)]
+    return mdtype, byte_count, None
+
+
+def _v5_uncompressed_array(path, name):
+    """
+    Locates the raw data of an uncompressed numeric variable of a MAT v5 (v6/v7) file.
+
+    :return: (offset, dtype, dims) of the real part stored in column-major order, None if the variable is
+             missing, compressed, complex or not a plain numeric array
+    """
+    with open(path, 'rb') as f:
+        header = f.read(128)
+        byte_order = '<' if header[126:128] == b'IM' else '>'
+        position = 128
+        while True:
+            f.seek(position)
+            mdtype, byte_count, _ = _v5_element_tag(f, byte_order)
+            if mdtype is None:
+                return None
+            next_position = position + 8 + byte_count
+            if mdtype != MI_MATRIX:
+                # compressed variables can't be read partially, their name is only known after inflating
+                position = next_position
+                continue
+            _v5_element_tag(f, byte_order)  # array flags
+            flags = struct.unpack(byte_order + 'II', f.read(8))[0]
+            _, dims_bytes, _ = _v5_element_tag(f, byte_order)
+            dims = struct.unpack(byte_order + '%di' % (dims_bytes // 4), f.read(dims_bytes))
+            f.read(-dims_bytes % 8)
+            _, name_bytes, small_name = _v5_element_tag(f, byte_order)
+            if small_name is None:
+                small_name = f.read(name_bytes)
+                f.read(-name_bytes % 8)
+            if small_name.decode('ascii') != name:
+                position = next_position
+                continue
+            data_type, data_bytes, small_data = _v5_element_tag(f, byte_order)
+            if flags & MAT_COMPLEX or small_data is not None or data_type not in MI_DTYPES:
+                return None
+            dtype = np.dtype(byte_order + MI_DTYPES[data_type])
+            if data_bytes != dtype.itemsize * int(np.prod(dims)):
+                return None
+            return f.tell(), dtype, dims
+
+
+class MatVideoReader:
+    """
+        Frame-range reader of the video variable of a .mat recording (MMPD), frames on the first axis as returned by
+        scipy.io.loadmat, so long recordings are decoded block by block instead of loading the whole file.
+
+        MAT v7.3 files are HDF5 and are read by slicing the dataset. Uncompressed variables of MAT v5 files store
+        frames as the fastest axis (column-major), so on the first read the variable is transposed once, in one
+        sequential pass, into a frame-major scratch file that every block is then sliced from; the scratch file takes
+        as much disk as the variable and is deleted on close. Compressed v5 variables (the default of MATLAB's save)
+        can't be read partially and are loaded once, with a warning.
+    """
+
+    def __init__(self, path, name='video', block_bytes=64 * 2 ** 20, scratch_dir=None):
+        """
+        :param path: .mat file
+        :param name: variable holding the frames, (frames, height, width, channels) in loadmat order
+        :param block_bytes: size of the frame blocks read at a time
+        :param scratch_dir: directory of the frame-major scratch file of v5 variables, None for the temp directory
+        """
+        self.path = path
+        self.name = name
+        self.h5 = None
+        self.array = None
+        self.scratch_dir = scratch_dir
+        self.scratch_path = None
+        if h5py.is_hdf5(path):
+            # MATLAB writes column-major arrays, the HDF5 dataset has the loadmat axes reversed
+            self.h5 = h5py.File(path, 'r')
+            self.video = self.h5[name]
+            self.shape = self.video.shape[::-1]
+            itemsize = self.video.dtype.itemsize
+        else:
+            self.array = _v5_uncompressed_array(path, name)
+            if self.array is not None:
+                self.video = None
+                self.shape = self.array[2]
+                itemsize = self.array[1].itemsize
+            else:
+                log_warning("%s: '%s' is compressed, loading the whole variable (save with -v7.3 or -nocompression "
+                            "to read it partially)" % (path, name))
+                self.video = sio.loadmat(path, variable_names=[name])[name]
+                self.shape = self.video.shape
+                itemsize = self.video.dtype.itemsize
+        self.block_bytes = block_bytes
+        self.block_size = max(1, block_bytes // (itemsize * int(np.prod(self.shape[1:]))))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read(self, start, end):
+        """
+        :return: frames [start, end) as an array in loadmat layout
+        """
+        if self.h5 is not None:
+            return np.transpose(self.video[..., start:end])
+        if self.array is not None:
+            self._transpose_v5()
+        return np.ascontiguousarray(self.video[start:end])
+
+    def _transpose_v5(self):
+        # frames are the fastest axis in column-major order: the variable is read once sequentially in pieces of
+        # block_bytes, (pixels, frames) each, and written frame-major; a variable within block_bytes stays in memory
+        offset, dtype, dims = self.array
+        self.array = None
+        frame_total, pixels = dims[0], int(np.prod(dims[1:]))
+        if frame_total * pixels * dtype.itemsize <= self.block_bytes:
+            frames = np.empty((frame_total, pixels), dtype)
+        else:
+            fd, self.scratch_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.', suffix='.frames',
+                                                     dir=self.scratch_dir)
+            os.close(fd)
+            frames = np.memmap(self.scratch_path, dtype, 'w+', shape=(frame_total, pixels))
+        rows = max(1, self.block_bytes // (frame_total * dtype.itemsize))
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for row in range(0, pixels, rows):
+                count = min(rows, pixels - row)
+                frames[:, row:row + count] = np.fromfile(f, dtype, count * frame_total).reshape(count, frame_total).T
+        # pixels are column-major (height fastest), the loadmat layout is a transposed view
+        self.video = np.transpose(frames.reshape((frame_total,) + tuple(dims[:0:-1])),
+                                  (0,) + tuple(range(len(dims) - 1, 0, -1)))
+
+    def blocks(self, start=0, end=None, block_size=None):
+        """
+        :param block_size: number of frames per block, None for block_bytes
+        :return: generator of consecutive frame blocks covering [start, end)
+        """
+        end = len(self) if end is None else min(end, len(self))
+        block_size = block_size or self.block_size
+        for block_start in range(start, end, block_size):
+            yield self.read(block_start, min(block_start + block_size, end))
+
+    def frames(self, start=0, end=None, block_size=None):
+        """
+        :return: generator of the frames [start, end), read block_size frames at a time
+        """
+        for block in self.blocks(start, end, block_size):
+            yield from block
+
+    def variable(self, name):
+        """
+        :return: another (small) variable of the file, e.g. the GT_ppg label, in loadmat layout
+        """
+        if self.h5 is not None:
+            return np.transpose(self.h5[name][()])
+        return sio.loadmat(self.path, variable_names=[name])[name]
+
+    def close(self):
+        if self.h5 is not None:
+            self.h5.close()
+        self.video = None
+        if self.scratch_path is not None:
+            os.remove(self.scratch_path)
+            self.scratch_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -149,8 +149,6 @@ def test_fn(epoch, model, dataloaders, cal_type, metrics, eval_time_length=10, w
     fs = 30
 
     interval = fs * eval_time_length
-    empty_tensor = torch.empty(1).to('cuda')
-    empty_tensor2 = torch.empty(1).to('cuda')
     with tqdm(dataloaders, desc=step, total=len(dataloaders), disable=False) as tepoch:
         _pred = []
         _target = []
@@ -162,14 +160,10 @@ def test_fn(epoch, model, dataloaders, cal_type, metrics, eval_time_length=10, w
                 else:
                     inputs, target = te
                 outputs = model(inputs)
-                if model_type == 'DIFF':
-                    empty_tensor = torch.cat((empty_tensor, outputs.squeeze()), dim=-1)
-                    empty_tensor2 = torch.cat((empty_tensor2, target.squeeze()), dim=-1)
-                else:
-                    empty_tensor = torch.cat((empty_tensor, outputs.view(-1).squeeze().to('cuda')), dim=-1)
-                    empty_tensor2 = torch.cat((empty_tensor2, target.view(-1).squeeze().to('cuda')), dim=-1)
-    prediction_chunks = torch.stack(list(torch.split(empty_tensor[1:].detach(), interval))[:-1], dim=0)
-    target_chunks = torch.stack(list(torch.split(empty_tensor2[1:].detach(), interval))[:-1], dim=0)
+                _pred.append(outputs.reshape(-1))
+                _target.append(target.reshape(-1).to(outputs.device))
+    prediction_chunks = torch.stack(list(torch.split(torch.cat(_pred).detach(), interval))[:-1], dim=0)
+    target_chunks = torch.stack(list(torch.split(torch.cat(_target).detach(), interval))[:-1], dim=0)
 
     hr_pred, hr_target = get_hr(prediction_chunks, target_chunks, model_type=model_type, cal_type=cal_type)
 
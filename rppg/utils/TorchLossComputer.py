@@ -31,12 +31,12 @@ class TorchLossComputer(object):
         two_pi_n_over_N = Variable(2 * math.pi * torch.arange(0, N, dtype=torch.float), requires_grad=True) / N
         hanning = Variable(torch.from_numpy(np.hanning(N)).type(torch.FloatTensor), requires_grad=True).view(1, -1)
 
-        k = k.type(torch.FloatTensor).cuda()
-        two_pi_n_over_N = two_pi_n_over_N.cuda()
-        hanning = hanning.cuda()
+        k = k.to(device=output.device, dtype=torch.float)
+        two_pi_n_over_N = two_pi_n_over_N.to(output.device)
+        hanning = hanning.to(output.device)
 
         output = output.view(1, -1) * hanning
-        output = output.view(1, 1, -1).type(torch.cuda.FloatTensor)
+        output = output.view(1, 1, -1).float()
         k = k.view(1, -1, 1)
         two_pi_n_over_N = two_pi_n_over_N.view(1, 1, -1)
         complex_absolute = torch.sum(output * torch.sin(k * two_pi_n_over_N), dim=-1) ** 2 \
@@ -63,8 +63,8 @@ class TorchLossComputer(object):
     def cross_entropy_power_spectrum_loss(inputs, target, Fs):
         inputs = inputs.view(1, -1)
         target = target.view(1, -1)
-        bpm_range = torch.arange(40, 180, dtype=torch.float).cuda()
-        # bpm_range = torch.arange(40, 260, dtype=torch.float).cuda()
+        bpm_range = torch.arange(40, 180, dtype=torch.float, device=inputs.device)
+        # bpm_range = torch.arange(40, 260, dtype=torch.float, device=inputs.device)
 
         complex_absolute = TorchLossComputer.complex_absolute(inputs, Fs, bpm_range)
 
@@ -81,8 +81,8 @@ class TorchLossComputer(object):
     def cross_entropy_power_spectrum_focal_loss(inputs, target, Fs, gamma):
         inputs = inputs.view(1, -1)
         target = target.view(1, -1)
-        bpm_range = torch.arange(40, 180, dtype=torch.float).cuda()
-        # bpm_range = torch.arange(40, 260, dtype=torch.float).cuda()
+        bpm_range = torch.arange(40, 180, dtype=torch.float, device=inputs.device)
+        # bpm_range = torch.arange(40, 260, dtype=torch.float, device=inputs.device)
 
         complex_absolute = TorchLossComputer.complex_absolute(inputs, Fs, bpm_range)
 
@@ -98,9 +98,9 @@ class TorchLossComputer(object):
     @staticmethod
     def cross_entropy_power_spectrum_forward_pred(inputs, Fs):
         inputs = inputs.view(1, -1)
-        bpm_range = torch.arange(40, 190, dtype=torch.float).cuda()
-        # bpm_range = torch.arange(40, 180, dtype=torch.float).cuda()
-        # bpm_range = torch.arange(40, 260, dtype=torch.float).cuda()
+        bpm_range = torch.arange(40, 190, dtype=torch.float, device=inputs.device)
+        # bpm_range = torch.arange(40, 180, dtype=torch.float, device=inputs.device)
+        # bpm_range = torch.arange(40, 260, dtype=torch.float, device=inputs.device)
 
         complex_absolute = TorchLossComputer.complex_absolute(inputs, Fs, bpm_range)
 
@@ -113,16 +113,16 @@ class TorchLossComputer(object):
     def cross_entropy_power_spectrum_DLDL_softmax2(inputs, target, Fs, std):
         target_distribution = [normal_sampling(int(target), i, std) for i in range(140)]
         target_distribution = [i if i > 1e-15 else 1e-15 for i in target_distribution]
-        target_distribution = torch.Tensor(target_distribution).cuda()
+        target_distribution = torch.Tensor(target_distribution).to(inputs.device)
 
         # pdb.set_trace()
 
-        rank = torch.Tensor([i for i in range(140)]).cuda()
+        rank = torch.Tensor([i for i in range(140)]).to(inputs.device)
 
         inputs = inputs.view(1, -1)
         target = target.view(1, -1)
 
-        bpm_range = torch.arange(40, 180, dtype=torch.float).cuda()
+        bpm_range = torch.arange(40, 180, dtype=torch.float, device=inputs.device)
 
         complex_absolute = TorchLossComputer.complex_absolute(inputs, Fs, bpm_range)
 
@@ -51,7 +51,7 @@ def detrend_torch(signals, Lambda):
     D = diag1 + diag2 + diag3
 
     filtered_signal = torch.bmm(signals.unsqueeze(1),
-                                (H - torch.linalg.inv(H + (Lambda ** 2) * torch.t(D) @ D)).to('cuda').expand(test_n, -1,
+                                (H - torch.linalg.inv(H + (Lambda ** 2) * torch.t(D) @ D)).to(signals.device).expand(test_n, -1,
                                                                                                              -1)).squeeze()
     return filtered_signal
 
@@ -105,7 +105,7 @@ def calc_hr_torch(calc_type, ppg_signals, fs=30., low_freq=0.75, high_freq=2.5):
     if calc_type == "FFT":
         N = _nearest_power_of_2(sig_length)
         psd = torch.abs(torch.fft.rfft(ppg_signals, n=N, dim=-1) ** 2)
-        freq = torch.linspace(0, 15, len(psd[0])).cuda()
+        freq = torch.linspace(0, 15, len(psd[0]), device=psd.device)
         f_mask = (freq >= low_freq) & (freq <= high_freq)
         freq = freq[f_mask]
         psd = psd[:, f_mask]
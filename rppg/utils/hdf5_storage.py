@@ -0,0 +1,306 @@
+import os
+
+import cv2
+import h5py
+import numpy as np
+
+from rppg.log import log_warning
+
+try:
+    # registers the Blosc filter with h5py, needed to both write and read Blosc compressed files
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+
+def compression_kwargs(compression):
+    """
+    :param compression: 'blosc', 'lzf', 'gzip' or None
+    :return: h5py create_dataset keyword arguments for the filter, Blosc falls back to LZF if hdf5plugin is missing
+    """
+    if compression is None or str(compression).lower() in ['', 'none']:
+        return {}
+    compression = compression.lower()
+    if compression == 'blosc':
+        if hdf5plugin is not None:
+            return dict(hdf5plugin.Blosc(cname='lz4', clevel=5, shuffle=hdf5plugin.Blosc.BITSHUFFLE))
+        log_warning("hdf5plugin is not installed, using lzf compression instead of blosc")
+        compression = 'lzf'
+    if compression == 'lzf':
+        return {'compression': 'lzf'}
+    if compression == 'gzip':
+        return {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True}
+    raise ValueError("unsupported hdf5 compression: %s" % compression)
+
+
+def time_chunks(shape, chunk_frames):
+    """
+    :param shape: dataset shape, time first
+    :param chunk_frames: number of frames per chunk
+    :return: chunk shape holding chunk_frames full frames, or None for a contiguous layout
+    """
+    if not chunk_frames or shape[0] == 0:
+        return None
+    return (min(chunk_frames, shape[0]),) + tuple(shape[1:])
+
+
+def video_key(img_size):
+    """
+    :return: dataset name of the frames preprocessed at img_size in a multi-resolution file
+    """
+    return 'raw_video_%d' % img_size
+
+
+def find_video(file, img_size):
+    """
+    :param file: opened preprocessed hdf5 file
+    :param img_size: frame size the model reads
+    :return: name of the dataset holding frames of img_size, 'raw_video' if the file was not preprocessed at that size
+    """
+    key = video_key(img_size)
+    return key if key in file else 'raw_video'
+
+
+# image codecs of encoded videos, frames are stored as uint8 images of value * 255
+VIDEO_CODECS = {'png': '.png', 'jpeg': '.jpg'}
+
+
+def video_codec(codec):
+    """
+    :param codec: preprocess.common.storage.codec, 'png' (lossless), 'jpeg' (near-lossless) or None
+    :return: codec name, None for float32 frames
+    """
+    if codec is None or str(codec).lower() in ['', 'none']:
+        return None
+    codec = str(codec).lower()
+    if codec not in VIDEO_CODECS:
+        raise ValueError("unsupported video codec: %s, choose from %s" % (codec, sorted(VIDEO_CODECS)))
+    return codec
+
+
+def open_video(file, name):
+    """
+    :param file: opened preprocessed hdf5 file
+    :param name: video dataset name, e.g. from find_video
+    :return: the dataset, or an EncodedVideo decoding it if the frames were stored with a codec
+    """
+    dataset = file[name]
+    return EncodedVideo(dataset) if 'codec' in dataset.attrs else dataset
+
+
+class EncodedVideo:
+    """
+        Read-only view of a video stored with a codec (see EncodedVideoStream): one encoded image per element of a
+        variable-length dataset, so the element index is the frame index and a frame range is read and decoded on
+        demand. Indexing works like on the float32 dataset and returns float32 frames in [0, 1].
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.codec = dataset.attrs['codec']
+        self.frame_shape = tuple(int(v) for v in dataset.attrs['frame_shape'])
+        # RGB frames are encoded as BGR, files written before that store the RGB values as they are
+        self.bgr = dataset.attrs.get('channel_order') == 'bgr'
+        self.shape = (dataset.shape[0],) + self.frame_shape
+        self.dtype = np.dtype(np.float32)
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _decode(self, data):
+        frame = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+        if self.bgr and frame.ndim == 3 and frame.shape[2] == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return (frame.reshape(self.frame_shape) / 255.).astype(np.float32)
+
+    def __getitem__(self, key):
+        frame_key, rest = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        if isinstance(frame_key, (int, np.integer)):
+            return self._decode(self.dataset[frame_key])[rest]
+        if frame_key is Ellipsis:
+            frame_key, rest = slice(None), (Ellipsis,) + rest
+        start, stop, step = frame_key.indices(len(self))
+        frames = np.empty((len(range(start, stop, step)),) + self.frame_shape, dtype=np.float32)
+        # one read of the encoded range, then a decode per frame
+        for i, data in enumerate(self.dataset[start:stop][::step]):
+            frames[i] = self._decode(data)
+        return frames[(slice(None),) + rest]
+
+    def __array__(self, dtype=None, copy=None):
+        frames = self[:]
+        return frames if dtype is None else frames.astype(dtype)
+
+
+class VideoStream:
+    """
+        Chunk-buffered appends to one resizable, time-chunked video dataset of an HDF5VideoWriter.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.buffer = None  # allocated on the first append, unused when blocks are written to the dataset directly
+        self.buffered = 0
+
+    def __len__(self):
+        return self.dataset.shape[0] + self.buffered
+
+    def append(self, frame):
+        if self.buffer is None:
+            self.buffer = np.empty(self.dataset.chunks, dtype=self.dataset.dtype)
+        self.buffer[self.buffered] = frame
+        self.buffered += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.buffered == 0:
+            return
+        frame_total = self.dataset.shape[0]
+        self.dataset.resize(frame_total + self.buffered, axis=0)
+        self.dataset[frame_total:] = self.buffer[:self.buffered]
+        self.buffered = 0
+
+    def resize(self, frame_total):
+        """
+        Truncates the video (or extends it, for writing blocks straight into self.dataset) to frame_total frames.
+        """
+        self.flush()
+        self.dataset.resize(frame_total, axis=0)
+
+
+class EncodedVideoStream(VideoStream):
+    """
+        VideoStream of a video stored with a codec: float frames in [0, 1] are quantized to uint8 and encoded one
+        image per frame (PNG lossless, JPEG near-lossless), chunk_frames encoded frames are buffered per append.
+    """
+
+    def __init__(self, dataset, codec, quality=95):
+        super().__init__(dataset)
+        self.extension = VIDEO_CODECS[codec]
+        self.params = []
+        if codec == 'jpeg':
+            # chroma subsampling averages the color differences the pulse is extracted from, keep full resolution
+            self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+            if hasattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR'):
+                self.params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444]
+        self.buffer = []
+
+    def __len__(self):
+        return self.dataset.shape[0] + len(self.buffer)
+
+    def append(self, frame):
+        frame = np.clip(np.rint(np.asarray(frame) * 255.), 0, 255).astype(np.uint8)
+        if frame.ndim == 3 and frame.shape[2] == 3:
+            # frames are RGB, the encoders expect BGR (JPEG derives its luma/chroma from the channel order)
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        ret, data = cv2.imencode(self.extension, frame, self.params)
+        if not ret:
+            raise ValueError("could not encode frame of shape %s as %s" % (frame.shape, self.extension))
+        self.buffer.append(data.reshape(-1))
+        if len(self.buffer) == self.dataset.chunks[0]:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        frame_total = self.dataset.shape[0]
+        self.dataset.resize(frame_total + len(self.buffer), axis=0)
+        self.dataset[frame_total:] = self.buffer
+        self.buffer = []
+
+
+class HDF5VideoWriter:
+    """
+        Streams the frames of a preprocessed video into resizable, time-chunked datasets (see VideoStream).
+
+        Frames are buffered one chunk at a time and appended as whole blocks, so memory stays at chunk_frames frames
+        per video whatever the video length. Everything goes to a temporary file next to path which only replaces
+        path on commit(); used as a context manager, a writer left without commit() (exception, no face found)
+        removes its temporary file and never leaves a half-written hdf5 behind.
+    """
+
+    def __init__(self, path, chunk_frames=180, compression='lzf', codec=None, quality=95):
+        """
+        :param path: destination hdf5 file path
+        :param chunk_frames: number of frames per chunk and per appended block, 0 falls back to 180
+        :param compression: 'blosc', 'lzf', 'gzip' or None
+        :param codec: 'png' or 'jpeg' to store 3 channel videos as encoded uint8 images, None for float32 frames
+        :param quality: JPEG quality
+        """
+        self.path = path
+        self.tmp_path = '%s.tmp%d' % (path, os.getpid())
+        self.chunk_frames = chunk_frames or 180
+        self.filter_kwargs = compression_kwargs(compression)
+        self.codec = video_codec(codec)
+        self.quality = quality
+        self.file = h5py.File(self.tmp_path, 'w')
+        self.videos = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.discard()
+
+    def create_video(self, name, frame_shape, dtype=np.float32):
+        """
+        :param name: dataset name, e.g. 'raw_video'
+        :param frame_shape: shape of one frame, e.g. (img_size, img_size, 3)
+        :return: empty VideoStream frames are appended to
+        """
+        if self.codec is not None:
+            # encoded frames are already compressed, hdf5 filters don't apply to variable-length data
+            dataset = self.file.create_dataset(name, shape=(0,), maxshape=(None,), chunks=(self.chunk_frames,),
+                                               dtype=h5py.vlen_dtype(np.uint8))
+            dataset.attrs['codec'] = self.codec
+            dataset.attrs['frame_shape'] = tuple(frame_shape)
+            dataset.attrs['channel_order'] = 'bgr'
+            self.videos.append(EncodedVideoStream(dataset, self.codec, self.quality))
+            return self.videos[-1]
+        dataset = self.file.create_dataset(name, shape=(0,) + tuple(frame_shape), maxshape=(None,) + tuple(frame_shape),
+                                           chunks=(self.chunk_frames,) + tuple(frame_shape), dtype=dtype,
+                                           **self.filter_kwargs)
+        self.videos.append(VideoStream(dataset))
+        return self.videos[-1]
+
+    def create_videos(self, img_sizes, channels):
+        """
+        One video per preprocessed size: a single size is stored as 'raw_video', several sizes as
+        video_key(img_size) each with 'raw_video' linked to the first one, so readers unaware of sizes keep working.
+
+        :return: dict img_size -> VideoStream
+        """
+        if len(img_sizes) == 1:
+            return {img_sizes[0]: self.create_video('raw_video', (img_sizes[0], img_sizes[0], channels))}
+        videos = {img_size: self.create_video(video_key(img_size), (img_size, img_size, channels))
+                  for img_size in img_sizes}
+        self.file['raw_video'] = videos[img_sizes[0]].dataset
+        return videos
+
+    def commit(self, **datasets):
+        """
+        Writes the remaining frames and the extra datasets (labels, hrv), then moves the file to path.
+
+        :param datasets: name -> array, chunked along time like the videos
+        """
+        for video in self.videos:
+            video.flush()
+        for name, value in datasets.items():
+            value = np.asarray(value)
+            chunks = time_chunks(value.shape, self.chunk_frames) if value.ndim > 0 else None
+            if chunks is None:
+                self.file.create_dataset(name, data=value)
+            else:
+                self.file.create_dataset(name, data=value, chunks=chunks, **self.filter_kwargs)
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        """
+        Drops the temporary file if the writer was not committed.
+        """
+        if self.file.id.valid:
+            self.file.close()
+        if os.path.isfile(self.tmp_path):
+            os.remove(self.tmp_path)
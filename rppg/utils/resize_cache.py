@@ -0,0 +1,112 @@
+import copy
+import hashlib
+import os
+
+import numpy as np
+
+CACHE_DIR_NAME = '.resize_cache'
+
+
+class ResizeCache:
+    """
+        Persistent on-disk cache of resized preprocessed videos.
+
+        Entries are stored as .npy files in a '.resize_cache' directory next to the source hdf5 file and
+        are keyed by the source path, size and mtime together with the resize parameters, so a changed
+        source file never hits a stale entry. Hits are memory-mapped. The total size of the cache
+        directories used by this instance is capped and the least recently used entries are evicted.
+        Copies handed to worker processes (deferred()) don't evict, the parent evicts once they are done
+        (evict_files()), so the workers can't each keep their own share of the cap.
+    """
+
+    def __init__(self, max_size_gb=50.):
+        self.max_bytes = int(max_size_gb * 1024 ** 3)
+        self.cache_dirs = set()
+        self.defer_eviction = False
+
+    @staticmethod
+    def cache_dir(file_name):
+        return os.path.join(os.path.dirname(os.path.abspath(file_name)), CACHE_DIR_NAME)
+
+    def deferred(self):
+        """
+        :return: copy of the cache for worker processes, writes entries without evicting
+        """
+        worker_cache = copy.copy(self)
+        worker_cache.cache_dirs = set()
+        worker_cache.defer_eviction = True
+        return worker_cache
+
+    @staticmethod
+    def cache_key(file_name, img_size, interpolation, channels, mode=''):
+        """
+        :param file_name: source hdf5 file path
+        :param img_size: target image size
+        :param interpolation: cv2 interpolation flag
+        :param channels: channel slice of the source video
+        :param mode: extra transform applied with the resize (e.g. 'raw')
+        :return: hex digest identifying the resized video
+        """
+        stat = os.stat(file_name)
+        key = '|'.join(map(str, [os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns, img_size, interpolation,
+                                 channels.start, channels.stop, channels.step, mode]))
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def cache_path(self, file_name, img_size, interpolation, channels, mode=''):
+        cache_dir = self.cache_dir(file_name)
+        self.cache_dirs.add(cache_dir)
+        stem = os.path.splitext(os.path.basename(file_name))[0]
+        key = self.cache_key(file_name, img_size, interpolation, channels, mode)
+        return os.path.join(cache_dir, stem + '_' + key[:16] + '.npy')
+
+    def load(self, file_name, img_size, interpolation, channels, resize_fn, mode=''):
+        """
+        :param resize_fn: called without arguments on a cache miss, returns the resized video
+        :return: memory-mapped resized video (read-only)
+        """
+        path = self.cache_path(file_name, img_size, interpolation, channels, mode)
+        if os.path.isfile(path):
+            os.utime(path)  # mark as recently used
+            return np.load(path, mmap_mode='r')
+
+        resized = resize_fn()
+        if resized.nbytes > self.max_bytes:
+            return resized
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp%d' % os.getpid()
+        with open(tmp_path, 'wb') as f:
+            np.save(f, resized)
+        os.replace(tmp_path, path)
+        if not self.defer_eviction:
+            self.evict(keep=path)
+        return np.load(path, mmap_mode='r')
+
+    def evict_files(self, file_names):
+        """
+        Evicts over the cache directories of file_names, after worker processes wrote their entries.
+        """
+        self.cache_dirs.update(self.cache_dir(file_name) for file_name in file_names)
+        self.evict()
+
+    def evict(self, keep=None):
+        entries = []
+        for cache_dir in self.cache_dirs:
+            if not os.path.isdir(cache_dir):
+                continue
+            for name in os.listdir(cache_dir):
+                if not name.endswith('.npy'):
+                    continue
+                path = os.path.join(cache_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            if os.path.isfile(path):
+                os.remove(path)
+            total -= size